@@ -0,0 +1,92 @@
+import pandas as pd
+
+# 发给 AI 的最近记录数 Recent readings included in the prompt
+RECENT_READINGS = 10
+# 趋势比较窗口（天）Trend window: last N days vs the N days before
+TREND_DAYS = 30
+
+_METRICS = [
+    ("Systolic", "收缩压 Systolic", "mmHg", "{:.0f}"),
+    ("Diastolic", "舒张压 Diastolic", "mmHg", "{:.0f}"),
+    ("Pulse", "脉搏 Pulse", "bpm", "{:.0f}"),
+    ("Glucose(mmol/L)", "血糖 Glucose", "mmol/L", "{:.1f}"),
+]
+
+_STATUSES = [
+    ("BP Status", "血压状态 BP status"),
+    ("Glucose Status", "血糖状态 Glucose status"),
+]
+
+
+def _metric_line(values, label, unit, fmt, cutoff):
+    values = values.dropna()
+    if values.empty:
+        return None
+    line = f"- {label}: avg {fmt.format(values.mean())} {unit}, range {fmt.format(values.min())}–{fmt.format(values.max())}"
+
+    recent = values[values.index > cutoff]
+    previous = values[(values.index <= cutoff) & (values.index > cutoff - pd.Timedelta(days=TREND_DAYS))]
+    if not recent.empty and not previous.empty:
+        change = recent.mean() - previous.mean()
+        arrow = "↑" if change > 0 else ("↓" if change < 0 else "→")
+        line += f"; last {TREND_DAYS}d {fmt.format(recent.mean())} vs prior {fmt.format(previous.mean())} ({arrow}{fmt.format(abs(change))})"
+    return line
+
+
+def _status_line(statuses, label):
+    statuses = statuses.astype(str).str.strip()
+    statuses = statuses[statuses != ""]
+    if statuses.empty:
+        return None
+    counts = statuses.value_counts()
+    in_range = counts.get("正常", 0) / len(statuses)
+    detail = " / ".join(f"{status} {count}" for status, count in counts.items())
+    return f"- {label}: {detail} (正常 in range {in_range:.0%})"
+
+
+# 一行一笔：时间|血压|脉搏|血糖|饭前后|吃药 One compact line per reading
+def _reading_line(timestamp, row):
+    def fmt(col, pattern):
+        value = row.get(col)
+        return pattern.format(value) if pd.notna(value) and value != "" else "-"
+
+    bp = f"{fmt('Systolic', '{:.0f}')}/{fmt('Diastolic', '{:.0f}')}"
+    meal = str(row.get("Before/After", "")).split(" ")[0] or "-"
+    took = str(row.get("Took Medication", "")).split(" ")[0] or "-"
+    return "|".join([
+        timestamp.strftime("%Y-%m-%d %H:%M"), bp, fmt("Pulse", "{:.0f}"), fmt("Glucose(mmol/L)", "{:.1f}"), meal, took
+    ])
+
+
+# ✅ 给 AI 的精简健康摘要 Compact health summary for the AI prompt
+# 每个数据版本只算一次（见 main.py 的缓存）Built once per data version (cached in main.py)
+def build_health_summary(df, insights=None):
+    if df.empty or not isinstance(df.index, pd.DatetimeIndex):
+        return "用户暂无健康数据 No health records yet."
+
+    cutoff = df.index.max() - pd.Timedelta(days=TREND_DAYS)
+    lines = [
+        "用户的健康数据 User health data:",
+        f"- 记录 Records: {len(df)} readings, {df.index.min():%Y-%m-%d} → {df.index.max():%Y-%m-%d}",
+    ]
+    for col, label, unit, fmt in _METRICS:
+        if col in df.columns:
+            line = _metric_line(df[col], label, unit, fmt, cutoff)
+            if line:
+                lines.append(line)
+    for col, label in _STATUSES:
+        if col in df.columns:
+            line = _status_line(df[col], label)
+            if line:
+                lines.append(line)
+
+    # 趋势/异常分析（analytics.insight_lines）Trend and anomaly findings from analytics.insight_lines
+    if insights:
+        lines.append("分析 Insights:")
+        lines.extend(insights)
+
+    recent = df.tail(RECENT_READINGS)
+    lines.append("")
+    lines.append(f"最近{len(recent)}笔记录 Recent readings (time|BP|pulse|glucose mmol/L|meal|took medication):")
+    lines.extend(_reading_line(timestamp, row) for timestamp, row in recent.iterrows())
+    return "\n".join(lines)
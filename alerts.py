@@ -0,0 +1,328 @@
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import gspread
+import pandas as pd
+from google.oauth2 import service_account
+
+import services
+from stock import project_stock
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import toml as tomllib
+
+logger = logging.getLogger(__name__)
+
+# ✅ 独立的提醒进程：python alerts.py
+# Standalone alert scheduler, run next to the app: python alerts.py [--once] [--dry-run]
+# 和页面无关，不会拖慢任何页面 Not tied to Streamlit reruns, so it adds nothing to page renders
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SECRETS_PATH = os.environ.get("HEALTH_TRACKER_SECRETS", os.path.join(APP_DIR, ".streamlit", "secrets.toml"))
+ALERTS_DB_NAME = "alerts.sqlite3"
+SPREADSHEET_NAME = "BP-Glucose-Tracker"
+
+# 检查间隔（秒）Seconds between checks
+CHECK_SECONDS = 15 * 60
+# 只提醒最近的异常记录 Only readings from the last N hours are alerted
+READING_LOOKBACK_HOURS = 24
+# 库存不足每天最多提醒一次 Low-stock alerts repeat at most once a day while still low
+STOCK_REPEAT_SECONDS = 24 * 60 * 60
+ABNORMAL_STATUSES = ("高", "低")
+
+# WhatsApp 单条上限 1600 字 WhatsApp caps a message at 1600 characters
+MAX_MESSAGE_CHARS = 1500
+# Twilio 普通号码约每秒 1 条 Twilio long codes send about one message per second
+MESSAGES_PER_SECOND = 1.0
+MAX_MESSAGES_PER_RUN = 20
+
+
+# ✅ 提醒进程用自己的缓存目录：两个进程不共享锁，不能写同一份本地表
+# The scheduler gets its own cache directory: it shares no locks with the app, so it must never write the app's store
+def alerts_cache_dir():
+    app_cache_dir = os.environ.get("HEALTH_TRACKER_CACHE_DIR", os.path.join(APP_DIR, ".cache"))
+    return os.environ.get("HEALTH_TRACKER_ALERTS_CACHE_DIR", os.path.join(app_cache_dir, "alerts"))
+
+
+def load_secrets(path=SECRETS_PATH):
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+# 和 main.py 一样的外部服务，按需创建 Same external clients as main.py, created on first use
+def register_services(secrets):
+    def init_google_sheets():
+        creds = service_account.Credentials.from_service_account_info(
+            secrets["gcp_service_account"],
+            scopes=[
+                "https://www.googleapis.com/auth/spreadsheets",
+                "https://www.googleapis.com/auth/drive"
+            ]
+        )
+        return gspread.authorize(creds)
+
+    def init_twilio_client():
+        twilio_rest = services.timed_import("twilio.rest")
+        return twilio_rest.Client(secrets["twilio"]["account_sid"], secrets["twilio"]["auth_token"])
+
+    services.register("sheets", init_google_sheets)
+    services.register("spreadsheet", lambda: services.get("sheets").open(SPREADSHEET_NAME))
+    services.register("twilio", init_twilio_client)
+
+
+# ✅ 发送通道 Transports
+class TwilioTransport:
+    def __init__(self, client, from_number, sms_from_number=None):
+        self.client = client
+        self.whatsapp_from = from_number if from_number.startswith("whatsapp:") else f"whatsapp:{from_number}"
+        self.sms_from = sms_from_number or from_number.replace("whatsapp:", "")
+
+    # 收件人以 "whatsapp:" 开头走 WhatsApp，否则发短信 "whatsapp:+60..." goes to WhatsApp, plain numbers get SMS
+    def send(self, to, body):
+        from_number = self.whatsapp_from if to.startswith("whatsapp:") else self.sms_from
+        return self.client.messages.create(from_=from_number, to=to, body=body).sid
+
+
+# 测试用，不真的发送 For tests and --dry-run: records messages instead of sending them
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, to, body):
+        self.sent.append((to, body))
+        logger.info("[dry run] to %s:\n%s", to, body)
+        return f"fake-{len(self.sent)}"
+
+
+class RateLimiter:
+    def __init__(self, per_second=MESSAGES_PER_SECOND, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = 0.0
+
+    def wait(self):
+        now = self.clock()
+        if self.next_at > now:
+            self.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def _patient_prefix(patient):
+    return f"[{patient}] " if patient else ""
+
+
+# ✅ 提醒内容：{"key", "text", "repeat"}，key 用于去重 Alerts as {"key", "text", "repeat"}; key is the dedupe key
+def stock_alerts(patient, projected_df):
+    alerts = []
+    if projected_df.empty:
+        return alerts
+    for _, row in projected_df[projected_df["Warning"] != ""].iterrows():
+        finish = row["Estimated Finish Date"]
+        finish_text = f"{finish:%Y-%m-%d}" if pd.notna(finish) else "-"
+        days_left = f"{row['Remaining Days']:.0f}" if pd.notna(row["Remaining Days"]) else "-"
+        alerts.append({
+            "key": f"stock|{patient}|{row['jie']}|{row['Refill Date']}|{row['Warning']}",
+            "text": f"💊 {_patient_prefix(patient)}{row['jie']}: {row['Warning']} "
+                    f"预计 {finish_text} 用完，剩 {days_left} 天 days left",
+            "repeat": STOCK_REPEAT_SECONDS,
+        })
+    return alerts
+
+
+def reading_alerts(patient, health_df, since):
+    alerts = []
+    if health_df.empty or not isinstance(health_df.index, pd.DatetimeIndex):
+        return alerts
+    recent = health_df.loc[since:]
+    prefix = _patient_prefix(patient)
+
+    if "BP Status" in recent.columns:
+        high_bp = recent[recent["BP Status"].astype(str).str.strip().isin(ABNORMAL_STATUSES)]
+        for timestamp, row in high_bp.iterrows():
+            alerts.append({
+                "key": f"bp|{patient}|{timestamp:%Y-%m-%d %H:%M:%S}",
+                "text": f"🩺 {prefix}{timestamp:%m-%d %H:%M} 血压 BP "
+                        f"{row['Systolic']:.0f}/{row['Diastolic']:.0f} mmHg ({str(row['BP Status']).strip()})",
+                "repeat": None,
+            })
+    if "Glucose Status" in recent.columns:
+        abnormal_glucose = recent[recent["Glucose Status"].astype(str).str.strip().isin(ABNORMAL_STATUSES)]
+        for timestamp, row in abnormal_glucose.iterrows():
+            alerts.append({
+                "key": f"glucose|{patient}|{timestamp:%Y-%m-%d %H:%M:%S}",
+                "text": f"🩸 {prefix}{timestamp:%m-%d %H:%M} 血糖 Glucose "
+                        f"{row['Glucose(mmol/L)']:.1f} mmol/L ({str(row['Glucose Status']).strip()})",
+                "repeat": None,
+            })
+    return alerts
+
+
+# 每位病人同步一次数据再检查 Sync each patient's tables, then evaluate them
+# local_store 在这里才导入，main() 先选好缓存目录 local_store is imported here so main() can pick the cache directory first
+def collect_alerts(spreadsheet, now=None):
+    import local_store
+
+    now = now or time.time()
+    # 表格里是本地时间 Sheet timestamps are local time
+    since = pd.Timestamp(datetime.datetime.fromtimestamp(now)) - pd.Timedelta(hours=READING_LOOKBACK_HOURS)
+    today = datetime.date.fromtimestamp(now)
+
+    patients = local_store.patients_from_titles(ws.title for ws in spreadsheet.worksheets())
+    alerts = []
+    for patient in patients or [local_store.DEFAULT_PATIENT]:
+        try:
+            health_name = local_store.table_name("health", patient)
+            stock_name = local_store.table_name("stock", patient)
+            local_store.refresh_table(spreadsheet, health_name)
+            local_store.refresh_table(spreadsheet, stock_name)
+            health_df = local_store.read_table(spreadsheet.id, health_name)
+            stock_df = local_store.read_table(spreadsheet.id, stock_name)
+        except Exception:
+            logger.exception("Could not load tables for patient %r", patient)
+            continue
+        alerts.extend(stock_alerts(patient, project_stock(stock_df, health_df, today=today)))
+        alerts.extend(reading_alerts(patient, health_df, since))
+    return alerts
+
+
+# ✅ 去重记录 Dedupe log: which alert went to which recipient, and when
+def _connect(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS sent_alerts (
+            key TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (key, recipient)
+        )"""
+    )
+    return conn
+
+
+def _unsent(conn, alerts, recipient, now):
+    fresh = []
+    for alert in alerts:
+        row = conn.execute(
+            "SELECT sent_at FROM sent_alerts WHERE key = ? AND recipient = ?", (alert["key"], recipient)
+        ).fetchone()
+        if row is None or (alert["repeat"] is not None and now - row[0] >= alert["repeat"]):
+            fresh.append(alert)
+    return fresh
+
+
+def _mark_sent(conn, keys, recipient, now):
+    conn.executemany(
+        "INSERT OR REPLACE INTO sent_alerts (key, recipient, sent_at) VALUES (?, ?, ?)",
+        [(key, recipient, now) for key in keys],
+    )
+    conn.commit()
+
+
+# ✅ 合并成尽量少的消息 Pack alerts into as few messages as possible
+# 返回 [(正文, [key])] Returns [(body, [keys])]
+def batch_alerts(alerts, limit=MAX_MESSAGE_CHARS):
+    header = "健康提醒 Health alerts:"
+    messages = []
+    lines, keys = [header], []
+    for alert in alerts:
+        text = alert["text"][:limit - len(header) - 1]
+        if keys and sum(len(line) + 1 for line in lines) + len(text) > limit:
+            messages.append(("\n".join(lines), keys))
+            lines, keys = [header], []
+        lines.append(text)
+        keys.append(alert["key"])
+    if keys:
+        messages.append(("\n".join(lines), keys))
+    return messages
+
+
+# ✅ 按收件人去重，合并后限速发送 Dedupe per recipient, then send in batches with rate limiting
+# 发送失败的不记录，下次再发 Failed sends aren't recorded, so they go out on the next run
+# dry_run：照常去重，但不记录，之后真正运行时照样发送 dry_run reads the dedupe log but never writes it, so a real run still sends
+def send_alerts(alerts, transport, recipients, path, limiter=None, now=None, dry_run=False):
+    now = now or time.time()
+    limiter = limiter or RateLimiter()
+
+    sent = 0
+    conn = _connect(path)
+    try:
+        for recipient in recipients:
+            for body, keys in batch_alerts(_unsent(conn, alerts, recipient, now)):
+                if sent >= MAX_MESSAGES_PER_RUN:
+                    logger.warning("Reached %d messages this run; the rest wait for the next run", sent)
+                    return sent
+                limiter.wait()
+                try:
+                    transport.send(recipient, body)
+                except Exception:
+                    logger.exception("Sending alerts to %s failed", recipient)
+                    break
+                if not dry_run:
+                    _mark_sent(conn, keys, recipient, now)
+                sent += 1
+    finally:
+        conn.close()
+    logger.info("%d alerts checked, %d messages sent", len(alerts), sent)
+    return sent
+
+
+# ✅ 检查一次并发送 One check: evaluate every patient, then send
+def run_once(spreadsheet, transport, recipients, path=None, limiter=None, now=None, dry_run=False):
+    now = now or time.time()
+    path = path or os.path.join(alerts_cache_dir(), ALERTS_DB_NAME)
+    return send_alerts(collect_alerts(spreadsheet, now), transport, recipients, path, limiter, now, dry_run)
+
+
+def _recipients(twilio_secrets):
+    recipients = twilio_secrets.get("to_numbers") or [twilio_secrets["to_number"]]
+    return [r for r in recipients if r]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Low-stock and abnormal-reading alerts 库存和异常提醒")
+    parser.add_argument("--once", action="store_true", help="check once and exit")
+    parser.add_argument("--dry-run", action="store_true", help="log messages instead of sending them; nothing is marked as sent")
+    parser.add_argument("--interval", type=int, default=CHECK_SECONDS, help="seconds between checks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # 必须在导入 sheet_sync/local_store 之前设置 Set before sheet_sync/local_store read it on import
+    cache_dir = alerts_cache_dir()
+    if "sheet_sync" in sys.modules and sys.modules["sheet_sync"].CACHE_DIR != cache_dir:
+        raise RuntimeError(f"sheet_sync was imported before the alerts cache directory ({cache_dir}) was set")
+    os.environ["HEALTH_TRACKER_CACHE_DIR"] = cache_dir
+    path = os.path.join(cache_dir, ALERTS_DB_NAME)
+
+    secrets = load_secrets()
+    register_services(secrets)
+    twilio_secrets = secrets.get("twilio", {})
+    recipients = _recipients(twilio_secrets)
+    if args.dry_run:
+        transport = FakeTransport()
+    else:
+        transport = TwilioTransport(
+            services.get("twilio"), twilio_secrets["from_number"], twilio_secrets.get("sms_from_number")
+        )
+    limiter = RateLimiter()
+
+    while True:
+        try:
+            run_once(services.get("spreadsheet"), transport, recipients, path, limiter=limiter, dry_run=args.dry_run)
+        except Exception:
+            logger.exception("Alert check failed")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+
+from health_data import BP_HIGH_DIASTOLIC, BP_HIGH_SYSTOLIC, GLUCOSE_HIGH
+from rollups import METRICS, processed_marker, processed_rows
+
+GLUCOSE = "Glucose(mmol/L)"
+
+# 移动平均窗口 Rolling average windows
+ROLLING_WINDOWS = {"7d": "7D", "30d": "30D"}
+
+# 时段：按记录时间分 Time-of-day buckets by the reading's hour
+TIME_OF_DAY_LABELS = ["早上 Morning", "下午 Afternoon", "晚上 Evening"]
+TIME_OF_DAY_BINS = [0, 12, 18, 24]
+
+MEAL_LABELS = {"饭前": "饭前 Before", "饭后": "饭后 After"}
+
+# 异常值：和之前所有记录相比超过 3 个标准差 Outliers: more than 3 SD from all earlier readings
+OUTLIER_Z = 3.0
+OUTLIER_MIN_HISTORY = 10
+# 连续几天日均偏高算持续偏高 Consecutive days with a high daily mean that count as sustained
+SUSTAINED_DAYS = 3
+
+
+def _add(old, new):
+    if old is None:
+        return new
+    return {key: old[key].add(new[key], fill_value=0) for key in new}
+
+
+def _grouped_sums(values, keys):
+    grouped = values.groupby(keys, observed=True)
+    return {"sum": grouped.sum(min_count=1), "count": grouped.count()}
+
+
+def _time_of_day(df):
+    # 没填时间的记录不算 Readings without a time are left out
+    has_time = df["Time Period"].astype(str).str.strip() != "" if "Time Period" in df.columns else False
+    hours = pd.Series(df.index.hour, index=df.index).where(has_time)
+    return pd.cut(hours, TIME_OF_DAY_BINS, right=False, labels=TIME_OF_DAY_LABELS).astype(object)
+
+
+def _meal(df):
+    first_word = df["Before/After"].astype(str).str.strip().str.split(" ").str[0]
+    return first_word.map(MEAL_LABELS)
+
+
+# 时间窗口的移动平均只需要往前看一个窗口 A time-based rolling mean only needs one window of history
+def _rolling(df, metrics, start):
+    if start:
+        window_start = df.index[start] - max(pd.Timedelta(w) for w in ROLLING_WINDOWS.values())
+        context = df.iloc[df.index.searchsorted(window_start):]
+        offset = start - (len(df) - len(context))
+    else:
+        context, offset = df, 0
+    columns = {}
+    for label, window in ROLLING_WINDOWS.items():
+        rolled = context[metrics].rolling(window).mean()
+        for metric in metrics:
+            columns[f"{metric} {label}"] = rolled[metric]
+    return pd.DataFrame(columns).iloc[offset:]
+
+
+# ✅ 异常值（向量化）：每笔记录和它之前的所有记录比较
+# Vectorized outliers: each reading is compared with the running mean/SD of every earlier reading
+def _outliers(new_rows, metrics, moments):
+    found = []
+    updated = {}
+    for metric in metrics:
+        values = new_rows[metric].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        count0, sum0, sumsq0 = moments.get(metric, (0, 0.0, 0.0))
+
+        count = count0 + np.cumsum(valid)
+        total = sum0 + np.cumsum(filled)
+        sumsq = sumsq0 + np.cumsum(filled ** 2)
+        # 不含当前这笔 Statistics of the readings before this one
+        prior_count = count - valid
+        prior_total = total - filled
+        prior_sumsq = sumsq - filled ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = prior_total / prior_count
+            var = (prior_sumsq - prior_count * mean ** 2) / (prior_count - 1)
+            z = (values - mean) / np.sqrt(np.maximum(var, 0))
+        flagged = valid & (prior_count >= OUTLIER_MIN_HISTORY) & (np.abs(z) > OUTLIER_Z) & np.isfinite(z)
+
+        positions = np.flatnonzero(flagged)
+        if len(positions):
+            found.append(pd.DataFrame({
+                "Metric": metric,
+                "Value": values[positions],
+                "Usual": mean[positions],
+                "Z": z[positions],
+            }, index=new_rows.index[positions]))
+        if len(values):
+            updated[metric] = (int(count[-1]), float(total[-1]), float(sumsq[-1]))
+        else:
+            updated[metric] = (count0, sum0, sumsq0)
+    return found, updated
+
+
+def _no_outliers():
+    return pd.DataFrame(columns=["Metric", "Value", "Usual", "Z"], index=pd.DatetimeIndex([], name="Timestamp"))
+
+
+def _runs(flags, kind):
+    if not flags.any():
+        return []
+    run_id = (flags != flags.shift()).cumsum()
+    runs = flags[flags].groupby(run_id[flags])
+    episodes = []
+    for _, run in runs:
+        if len(run) >= SUSTAINED_DAYS:
+            episodes.append({"Kind": kind, "Start": run.index[0], "End": run.index[-1], "Days": len(run)})
+    return episodes
+
+
+# ✅ 持续偏高：连续几天日均值超标 Sustained highs: runs of consecutive days whose daily mean is high
+def _sustained(daily):
+    if daily is None or daily["count"].empty:
+        return pd.DataFrame(columns=["Kind", "Start", "End", "Days"])
+    means = (daily["sum"] / daily["count"].replace(0, np.nan))
+    # 没有记录的日子中断连续 Days without readings break a run
+    days = pd.date_range(means.index.min(), means.index.max(), freq="D")
+    means = means.reindex(days)
+
+    def above(col, limit):
+        return means[col] > limit if col in means.columns else pd.Series(False, index=days)
+
+    high_bp = above("Systolic", BP_HIGH_SYSTOLIC) | above("Diastolic", BP_HIGH_DIASTOLIC)
+    high_glucose = above(GLUCOSE, GLUCOSE_HIGH)
+    episodes = _runs(high_bp, "血压偏高 High BP") + _runs(high_glucose, "血糖偏高 High glucose")
+    return pd.DataFrame(episodes, columns=["Kind", "Start", "End", "Days"])
+
+
+# ✅ 增量分析 Incremental analytics
+# 和汇总一样：只追加时只处理新行，否则整段重新计算
+# Like the rollups: appended rows are processed on their own, anything else rebuilds in one pass
+def update_analytics(state, df):
+    if not isinstance(df.index, pd.DatetimeIndex):
+        return None
+
+    columns = METRICS + ["Time Period", "Before/After"]
+    start = processed_rows(state, df, columns)
+    if start is None:
+        return state
+    if not start:
+        state = None
+
+    metrics = [m for m in METRICS if m in df.columns]
+    new_rows = df.iloc[start:]
+
+    rolling = _rolling(df, metrics, start)
+    time_of_day = _grouped_sums(new_rows[metrics], _time_of_day(new_rows))
+    meal = (
+        _grouped_sums(new_rows[GLUCOSE], _meal(new_rows))
+        if GLUCOSE in df.columns and "Before/After" in df.columns else None
+    )
+    daily = _grouped_sums(new_rows[metrics], new_rows.index.normalize())
+    outliers, moments = _outliers(new_rows, metrics, state["moments"] if state else {})
+
+    if state:
+        rolling = pd.concat([state["rolling"], rolling])
+        time_of_day = _add(state["time_of_day"], time_of_day)
+        meal = _add(state["meal"], meal) if meal is not None else state["meal"]
+        daily = _add(state["daily"], daily)
+        outliers = [state["outliers"]] + outliers
+    outliers = [o for o in outliers if len(o)]
+
+    return {
+        **processed_marker(state, df, start, columns),
+        "rolling": rolling,
+        "time_of_day": time_of_day,
+        "meal": meal,
+        "daily": daily,
+        "moments": moments,
+        "outliers": pd.concat(outliers).sort_index(kind="stable") if outliers else _no_outliers(),
+        "sustained": _sustained(daily),
+    }
+
+
+# 各时段平均值 Mean per metric for each time of day
+def time_of_day_means(state):
+    agg = state["time_of_day"]
+    means = agg["sum"] / agg["count"].replace(0, np.nan)
+    return means.reindex(TIME_OF_DAY_LABELS).dropna(how="all")
+
+
+# 饭前/饭后血糖 Glucose before vs after meals: mean and count
+def meal_glucose(state):
+    agg = state["meal"]
+    if agg is None:
+        return pd.DataFrame(columns=["mean", "count"])
+    return pd.DataFrame({
+        "mean": agg["sum"] / agg["count"].replace(0, np.nan),
+        "count": agg["count"],
+    }).reindex(list(MEAL_LABELS.values())).dropna(subset=["mean"])
+
+
+# 给 AI 的分析摘要 Analytics lines for the AI prompt
+def insight_lines(state):
+    if state is None or not state["rows"]:
+        return []
+    lines = []
+
+    latest = state["rolling"].iloc[-1]
+    parts = []
+    if pd.notna(latest.get("Systolic 7d")) and pd.notna(latest.get("Diastolic 7d")):
+        parts.append(f"BP {latest['Systolic 7d']:.0f}/{latest['Diastolic 7d']:.0f} mmHg")
+    if pd.notna(latest.get(f"{GLUCOSE} 7d")):
+        parts.append(f"glucose {latest[f'{GLUCOSE} 7d']:.1f} mmol/L")
+    if parts:
+        lines.append(f"- 7天平均 7-day average: {', '.join(parts)}")
+
+    by_time = time_of_day_means(state)
+    if len(by_time) > 1:
+        detail = " / ".join(
+            f"{label.split(' ')[-1]} "
+            + ", ".join(
+                f"{name} {row[col]:{fmt}}" for col, name, fmt in
+                (("Systolic", "sys", ".0f"), (GLUCOSE, "glu", ".1f")) if col in row and pd.notna(row[col])
+            )
+            for label, row in by_time.iterrows()
+        )
+        lines.append(f"- 时段 By time of day: {detail}")
+
+    meals = meal_glucose(state)
+    if not meals.empty:
+        detail = " vs ".join(f"{label.split(' ')[-1]} {row['mean']:.1f}" for label, row in meals.iterrows())
+        lines.append(f"- 饭前/饭后血糖 Glucose by meal: {detail} mmol/L")
+
+    outliers = state["outliers"]
+    if not outliers.empty:
+        last_time = outliers.index.max()
+        last = outliers.loc[[last_time]].iloc[-1]
+        lines.append(
+            f"- 异常读数 Unusual readings: {len(outliers)} "
+            f"(latest {last_time:%Y-%m-%d} {last['Metric']} {last['Value']:g}, usual ≈ {last['Usual']:.1f})"
+        )
+
+    for _, episode in state["sustained"].tail(3).iterrows():
+        lines.append(
+            f"- 持续偏高 Sustained: {episode['Kind']} {episode['Days']} days "
+            f"({episode['Start']:%Y-%m-%d} → {episode['End']:%Y-%m-%d})"
+        )
+    return lines
@@ -0,0 +1,390 @@
+import argparse
+import collections
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ✅ 离线性能测试：python benchmark.py --sizes 1000,10000,100000
+# Offline benchmark: main.py runs against in-process fakes of Sheets, Vision and Groq
+# 每个数据量在独立进程中运行，缓存和内存互不影响 Each dataset size runs in its own process for clean caches and memory
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+MEDICATIONS = 20
+# (报告名, 侧边栏选项) (report label, sidebar option)
+PAGES = [
+    ("Data Entry", "📝 数据输入 Data Entry"),
+    ("Charts", "📊 趋势图表 Charts"),
+    ("Medication", "💊 药物管理 Medication"),
+    ("Assistant", "🤖 AI 助手 AI Assistant"),
+]
+APP_TIMEOUT_SECONDS = 1800
+
+# 所有假服务共用的调用计数 API call counter shared by every fake
+calls = collections.Counter()
+
+
+# ✅ 假的 gspread：只在内存里 In-memory stand-ins for gspread objects
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, worksheet_id, title, values):
+        self.spreadsheet = spreadsheet
+        self.id = worksheet_id
+        self.title = title
+        self.values = values
+
+    def _count(self, method):
+        calls[f"sheets.{method}"] += 1
+
+    def _range(self, a1):
+        from gspread.utils import a1_to_rowcol
+        start, _, end = a1.partition(":")
+        (r1, c1), (r2, c2) = a1_to_rowcol(start), a1_to_rowcol(end or start)
+        return [row[c1 - 1:c2] for row in self.values[r1 - 1:r2]]
+
+    def get_all_values(self):
+        self._count("get_all_values")
+        return [list(row) for row in self.values]
+
+    def get_all_records(self):
+        self._count("get_all_records")
+        header = self.values[0]
+        return [dict(zip(header, row)) for row in self.values[1:]]
+
+    def get(self, a1):
+        self._count("get")
+        return self._range(a1)
+
+    def batch_get(self, ranges):
+        self._count("batch_get")
+        return [self._range(a1) for a1 in ranges]
+
+    def _append(self, rows):
+        start = len(self.values) + 1
+        self.values.extend([str(v) for v in row] for row in rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:Z{len(self.values)}"}}
+
+    def append_row(self, row, **kwargs):
+        self._count("append_row")
+        return self._append([row])
+
+    def append_rows(self, rows, **kwargs):
+        self._count("append_rows")
+        return self._append(rows)
+
+    def find(self, query):
+        self._count("find")
+        for r, row in enumerate(self.values, start=1):
+            for c, value in enumerate(row, start=1):
+                if value == query:
+                    return FakeCell(r, c, value)
+        return None
+
+    def _set(self, row, col, value):
+        while len(self.values) < row:
+            self.values.append([])
+        cells = self.values[row - 1]
+        cells.extend([""] * (col - len(cells)))
+        cells[col - 1] = str(value)
+
+    def update_cell(self, row, col, value):
+        self._count("update_cell")
+        self._set(row, col, value)
+
+    def batch_update(self, data, **kwargs):
+        from gspread.utils import a1_to_rowcol
+        self._count("batch_update")
+        for item in data:
+            row, col = a1_to_rowcol(item["range"])
+            self._set(row, col, item["values"][0][0])
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheet_id, sheets):
+        self.id = spreadsheet_id
+        self._worksheets = {
+            title: FakeWorksheet(self, i, title, values) for i, (title, values) in enumerate(sheets.items())
+        }
+
+    def worksheet(self, title):
+        calls["sheets.worksheet"] += 1
+        from gspread.exceptions import WorksheetNotFound
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self):
+        calls["sheets.worksheets"] += 1
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title, rows, cols):
+        calls["sheets.add_worksheet"] += 1
+        worksheet = FakeWorksheet(self, len(self._worksheets), title, [])
+        self._worksheets[title] = worksheet
+        return worksheet
+
+
+class FakeSheetsClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, name):
+        calls["sheets.open"] += 1
+        return self.spreadsheet
+
+
+# ✅ 假的 Vision：固定返回血压计读数 Fake Vision client returning a fixed monitor reading
+class FakeVisionClient:
+    WORDS = [("SYS", 10, 10, 20), ("132", 60, 10, 60), ("DIA", 10, 90, 20), ("84", 60, 90, 60),
+             ("PUL", 10, 170, 20), ("72", 60, 170, 40)]
+
+    def _annotation(self, text, left, top, height):
+        vertices = [types.SimpleNamespace(x=x, y=y) for x, y in
+                    ((left, top), (left + 40, top), (left + 40, top + height), (left, top + height))]
+        return types.SimpleNamespace(description=text, bounding_poly=types.SimpleNamespace(vertices=vertices))
+
+    def text_detection(self, image):
+        calls["vision.text_detection"] += 1
+        full_text = "\n".join(f"{label} {value}" for (label, *_), (value, *_) in zip(self.WORDS[::2], self.WORDS[1::2]))
+        annotations = [types.SimpleNamespace(description=full_text, bounding_poly=None)]
+        annotations += [self._annotation(*word) for word in self.WORDS]
+        return types.SimpleNamespace(text_annotations=annotations, error=types.SimpleNamespace(message=""))
+
+
+# ✅ 假的 Groq（OpenAI 兼容接口，本机 HTTP）Fake Groq: a local OpenAI-compatible HTTP endpoint
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    ANSWER = "你的血压最近比较稳定。Your blood pressure has been stable lately. Keep taking your medication on time."
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        calls["groq.chat_completions"] += 1
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 30, "total_tokens": prompt_tokens + 30}
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for word in self.ANSWER.split(" "):
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+        else:
+            payload = json.dumps({
+                "choices": [{"message": {"content": '{"systolic": 132, "diastolic": 84, "pulse": 72}'}}],
+                "usage": usage,
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+
+def start_fake_groq():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGroqHandler)
+    threading.Thread(target=server.serve_forever, name="fake-groq", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/v1"
+
+
+# ✅ 合成数据 Synthetic datasets
+def synthetic_sheets(size, seed=0):
+    import numpy as np
+    import pandas as pd
+    from health_data import HEALTH_SHEET_COLUMNS, STOCK_SHEET_COLUMNS, classify_bp, classify_glucose
+
+    rng = np.random.default_rng(seed)
+    medications = np.array([f"Med-{i:02d}" for i in range(MEDICATIONS)], dtype=object)
+    # 间隔随数据量缩短，1M 行也在合理的日期范围内 Spacing shrinks with size so 1M rows stay within ~20 years
+    spacing = min(pd.Timedelta(hours=6), pd.Timedelta(days=20 * 365) / size).floor("s")
+    end = pd.Timestamp.now().floor("min")
+    timestamps = pd.date_range(end=end, periods=size, freq=spacing)
+
+    # 重复的字符串共用同一个对象，1M 行也不会占太多内存 Reuse string objects so 1M rows stay compact
+    def as_text(values, fmt="{}"):
+        unique, inverse = np.unique(values, return_inverse=True)
+        return np.array([fmt.format(v) for v in unique], dtype=object)[inverse]
+
+    systolic = rng.normal(132, 14, size).round().clip(70, 240)
+    diastolic = rng.normal(84, 8, size).round().clip(40, 140)
+    pulse = rng.normal(74, 8, size).round().clip(40, 160)
+    glucose = rng.normal(6.5, 1.5, size).round(1).clip(2.5, 20)
+    took = rng.random(size) < 0.7
+    blank = np.full(size, "", dtype=object)
+
+    columns = [
+        as_text(timestamps.strftime("%Y-%m-%d")),
+        as_text(timestamps.strftime("%H:%M:%S")),
+        np.where(took, "是 Yes", "否 NO").astype(object),
+        np.where(took, medications[rng.integers(0, MEDICATIONS, size)], "无 None").astype(object),
+        np.where(rng.random(size) < 0.5, "饭前 Before", "饭后 After").astype(object),
+        blank,
+        as_text(systolic, "{:.0f}"), as_text(diastolic, "{:.0f}"), as_text(pulse, "{:.0f}"),
+        classify_bp(systolic, diastolic).astype(object), blank,
+        as_text(glucose, "{:.1f}"), classify_glucose(glucose).astype(object), blank,
+    ]
+    health = [list(HEALTH_SHEET_COLUMNS)] + [list(row) for row in zip(*columns)]
+
+    stock = [list(STOCK_SHEET_COLUMNS)]
+    for name in medications:
+        refill = end - pd.Timedelta(days=int(rng.integers(0, 60)))
+        stock.append([name, refill.strftime("%Y-%m-%d"), str(rng.choice([30, 60, 90])), str(rng.choice([1, 2])), ""])
+    return {"Sheet1": health, "Medication Stock": stock}
+
+
+def _rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # Linux 单位是 KB，macOS 是字节 ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _measure(results, step, action):
+    import tracemalloc
+    before = calls.copy()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    action()
+    seconds = time.perf_counter() - start
+    results.append({
+        "step": step,
+        "seconds": round(seconds, 3),
+        "calls": dict(calls - before),
+        "peak_rss_mb": round(_rss_mb() or 0, 1),
+        "peak_alloc_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if tracing else None,
+    })
+
+
+def _check(at, step):
+    if at.exception:
+        raise RuntimeError(f"{step} failed: {at.exception[0].message}")
+    return at
+
+
+# ✅ 单个数据量：冷启动、各页面首次和再次渲染、AI 提问、OCR
+# One dataset size: cold start, first and repeat render of every page, an AI question and OCR
+def run_size(size, cache_dir, trace_memory=False):
+    import tracemalloc
+    if trace_memory:
+        tracemalloc.start()
+
+    # 必须在导入应用模块之前设置 Must be set before any app module computes CACHE_DIR
+    os.environ["HEALTH_TRACKER_CACHE_DIR"] = cache_dir
+
+    import services
+    from streamlit.testing.v1 import AppTest
+
+    results = []
+    spreadsheet_holder = {}
+    _measure(results, "generate dataset", lambda: spreadsheet_holder.update(
+        spreadsheet=FakeSpreadsheet(f"bench-{size}", synthetic_sheets(size))
+    ))
+    spreadsheet = spreadsheet_holder["spreadsheet"]
+
+    # 先注册假服务，main.py 的注册不会覆盖 Registered first, so main.py's own factories are ignored
+    services.register("sheets", lambda: FakeSheetsClient(spreadsheet))
+    services.register("vision", FakeVisionClient)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    at = AppTest.from_file(script, default_timeout=APP_TIMEOUT_SECONDS)
+    at.secrets["gcp_service_account"] = {}
+    at.secrets["groq"] = {"api_key": "bench", "base_url": start_fake_groq()}
+
+    _measure(results, "cold start (load + Data Entry)", lambda: _check(at.run(), "cold start"))
+    for label, page in PAGES:
+        _measure(results, f"{label}: first render", lambda: _check(at.sidebar.radio[0].set_value(page).run(), page))
+        _measure(results, f"{label}: rerun", lambda: _check(at.run(), page))
+
+    def ask_ai():
+        at.text_input[0].set_value("我的血压趋势如何？How is my blood pressure trend?")
+        next(b for b in at.button if "Ask AI" in b.label).click()
+        _check(at.run(), "AI question")
+
+    _measure(results, "Assistant: ask a question", ask_ai)
+    _measure(results, "OCR: new photo", lambda: _run_ocr(seed=1))
+    _measure(results, "OCR: same photo again", lambda: _run_ocr(seed=1))
+    return results
+
+
+def _run_ocr(seed):
+    import ocr
+    import services
+    from PIL import Image
+
+    # 手机照片大小的合成图 A phone-sized synthetic photo
+    image = Image.new("RGB", (3000, 4000), (230, 230, 225))
+    image.paste((20 + seed, 20, 20), (900, 1200, 2100, 2800))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    full_text, words, _ = ocr.detect_text(lambda: services.get("vision"), buffer.getvalue())
+    return ocr.parse_reading_locally(full_text, words)
+
+
+def _format_calls(step_calls):
+    return ", ".join(f"{name.split('.', 1)[1]}×{count}" for name, count in sorted(step_calls.items())) or "-"
+
+
+def print_report(size, results):
+    print(f"\n=== {size:,} readings ===")
+    print(f"{'step':<34} {'seconds':>9} {'peak RSS MB':>12} {'peak alloc MB':>14}  API calls")
+    for r in results:
+        alloc = f"{r['peak_alloc_mb']:.1f}" if r["peak_alloc_mb"] is not None else "-"
+        print(f"{r['step']:<34} {r['seconds']:>9.3f} {r['peak_rss_mb']:>12.1f} {alloc:>14}  {_format_calls(r['calls'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark with fake Sheets/Vision/Groq 离线性能测试")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated reading counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--trace-memory", action="store_true", help="also report Python allocation peaks (slower)")
+    parser.add_argument("--json", help="write all results to this JSON file")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        cache_dir = tempfile.mkdtemp(prefix="health-bench-")
+        try:
+            print(json.dumps(run_size(args.child, cache_dir, trace_memory=args.trace_memory)))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return
+
+    report = {}
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        command = [sys.executable, os.path.abspath(__file__), "--child", str(size)]
+        if args.trace_memory:
+            command.append("--trace-memory")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"\n=== {size:,} readings: failed ===\n{completed.stderr[-2000:]}")
+            continue
+        results = json.loads(completed.stdout.strip().splitlines()[-1])
+        report[size] = results
+        print_report(size, results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
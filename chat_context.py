@@ -0,0 +1,80 @@
+import re
+
+# 每次请求的提示词预算（不含回答）Prompt token budget per request, excluding the answer
+CONTEXT_TOKEN_BUDGET = 3000
+# 超出预算的旧对话压缩成摘要的上限 Budget for the digest of older turns that no longer fit
+DIGEST_TOKEN_BUDGET = 300
+DIGEST_CHARS_PER_TURN = 80
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+# 粗略估算：中文约一字一个 token，其他约四个字符一个 token
+# Rough estimate: ~1 token per CJK character, ~4 characters per token otherwise
+def estimate_tokens(text):
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 4
+
+
+def _clip(text, limit=DIGEST_CHARS_PER_TURN):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+# 返回 (摘要, 摘要了几轮) Returns (digest text, turns covered)
+def _digest(turns):
+    lines = ["Earlier conversation (shortened) 之前的对话（摘要）:"]
+    used = estimate_tokens(lines[0])
+    # 从最近的开始保留 Keep the most recent of the older turns
+    kept = []
+    for turn in reversed(turns):
+        line = f"- Q: {_clip(turn['user'])} / A: {_clip(turn['ai'])}"
+        cost = estimate_tokens(line)
+        if used + cost > DIGEST_TOKEN_BUDGET:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        return None, 0
+    return "\n".join(lines + list(reversed(kept))), len(kept)
+
+
+# ✅ 多轮对话上下文，按 token 预算裁剪
+# Multi-turn context: health summary sent once, recent turns verbatim, older turns digested or dropped
+# 返回 (messages, 统计) Returns (messages, stats)
+def build_messages(system_prompt, health_summary, history, question, budget=CONTEXT_TOKEN_BUDGET):
+    head = [
+        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": health_summary},
+    ]
+    tail = [{"role": "user", "content": question}]
+    used = sum(estimate_tokens(m["content"]) for m in head + tail)
+
+    # 从最新一轮往回加，直到预算用完 Add turns newest-first until the budget runs out
+    included = []
+    for turn in reversed(history):
+        cost = estimate_tokens(turn["user"]) + estimate_tokens(turn["ai"])
+        if used + cost > budget - DIGEST_TOKEN_BUDGET:
+            break
+        included.append(turn)
+        used += cost
+    included.reverse()
+    older = history[:len(history) - len(included)]
+
+    digest, digested = _digest(older) if older else (None, 0)
+    if digest:
+        head.append({"role": "system", "content": digest})
+        used += estimate_tokens(digest)
+
+    turns = []
+    for turn in included:
+        turns.append({"role": "user", "content": turn["user"]})
+        turns.append({"role": "assistant", "content": turn["ai"]})
+
+    stats = {
+        "prompt_tokens": used,
+        "turns_included": len(included),
+        "turns_digested": digested,
+        "turns_dropped": len(older) - digested,
+    }
+    return head + turns + tail, stats
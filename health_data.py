@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+# 表头中英文对照 Sheet1 headers → English column names
+HEALTH_COLUMN_MAPPING = {
+    "日期": "Date",
+    "时间段": "Time Period",
+    "收缩压": "Systolic",
+    "舒张压": "Diastolic",
+    "血糖（mmol/L）": "Glucose(mmol/L)",
+    "脉搏": "Pulse",
+    "有吃药吗？": "Took Medication",
+    "药物名称": "Medication",
+    "饭前/饭后": "Before/After",
+    "剂量": "Dose",
+    "血压状态": "BP Status",
+    "血压备注": "BP Note",
+    "血糖状态": "Glucose Status",
+    "血糖备注": "Glucose Note"
+}
+
+# Sheet1 列顺序（与表单提交的行一致）Sheet1 column order, as written by the entry form
+HEALTH_SHEET_COLUMNS = [
+    "日期", "时间段", "有吃药吗？", "药物名称", "饭前/饭后", "剂量",
+    "收缩压", "舒张压", "脉搏", "血压状态", "血压备注", "血糖（mmol/L）", "血糖状态", "血糖备注"
+]
+
+# 药物库存表列顺序 Medication Stock column order
+STOCK_SHEET_COLUMNS = ["jie", "Refill Date", "Total Given", "Dose Per Day", "Note"]
+
+HEALTH_NUMERIC_COLUMNS = ["Systolic", "Diastolic", "Pulse", "Glucose(mmol/L)"]
+STOCK_NUMERIC_COLUMNS = ["Total Given", "Dose Per Day"]
+
+# ✅ 状态判断（表单提交时写入 Sheet1）Status rules written to Sheet1 on submit
+# 数字或数组都可以 Work on scalars and arrays alike
+BP_HIGH_SYSTOLIC = 140
+BP_HIGH_DIASTOLIC = 90
+GLUCOSE_HIGH = 7.8
+GLUCOSE_LOW = 3.9
+
+# ✅ 表单允许的范围（批量导入也用）Value ranges allowed by the entry form, also used by bulk import
+VALUE_RANGES = {
+    "Systolic": (50, 250),
+    "Diastolic": (30, 150),
+    "Pulse": (30, 180),
+    "Glucose(mmol/L)": (1.0, 20.0),
+}
+
+
+def classify_bp(systolic, diastolic):
+    status = np.where((np.asarray(systolic) > BP_HIGH_SYSTOLIC) | (np.asarray(diastolic) > BP_HIGH_DIASTOLIC), "高", "正常")
+    return status.item() if status.ndim == 0 else status
+
+
+def classify_glucose(glucose):
+    glucose = np.asarray(glucose)
+    status = np.where(glucose > GLUCOSE_HIGH, "高", np.where(glucose < GLUCOSE_LOW, "低", "正常"))
+    return status.item() if status.ndim == 0 else status
+
+
+def _drop_blank(df):
+    # 去掉空表头列和完全空白的行 Drop unnamed/duplicate columns and fully blank rows
+    df = df.loc[:, (df.columns != "") & ~df.columns.duplicated()]
+    if df.empty:
+        return df.copy()
+    return df[(df != "").any(axis=1)].copy()
+
+
+# 时间列 "08:30" 补成 "08:30:00" 再解析 Time cells like "08:30" are padded to "08:30:00" before parsing
+def _time_of_day(series):
+    times = series.astype(str).str.strip().str.replace(r"^(\d{1,2}:\d{2})$", r"\1:00", regex=True)
+    return pd.to_timedelta(times, errors="coerce").fillna(pd.Timedelta(0))
+
+
+# 保持按时间排序（新行一般在末尾，已排序时不重排）Keep the table sorted by time; a no-op for in-order appends
+def sort_by_timestamp(df):
+    if isinstance(df.index, pd.DatetimeIndex) and not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind="stable")
+    return df
+
+
+# ✅ 健康记录整理 Normalize raw Sheet1 rows
+# 以 日期+时间 作为排序的时间索引，日期范围查询可以二分查找
+# Indexed by a sorted Date+Time timestamp so date-range queries are binary-search slices
+def normalize_health_records(raw_df):
+    df = _drop_blank(raw_df).rename(columns=HEALTH_COLUMN_MAPPING)
+
+    # Clean up the data
+    if "Date" in df.columns:
+        df["Date"] = pd.to_datetime(df["Date"], errors='coerce').dt.normalize()
+        df = df.dropna(subset=["Date"])
+        timestamps = df["Date"]
+        if "Time Period" in df.columns:
+            timestamps = timestamps + _time_of_day(df["Time Period"])
+        df.index = pd.DatetimeIndex(timestamps, name="Timestamp")
+
+    # Convert numeric columns and handle empty strings
+    for col in HEALTH_NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    df = df.dropna(how='all')
+
+    if "Date" not in df.columns:
+        return df.reset_index(drop=True)
+    return sort_by_timestamp(df)
+
+
+# ✅ 药物库存整理 Normalize raw Medication Stock rows
+def normalize_stock_records(raw_df):
+    df = _drop_blank(raw_df)
+
+    if "Refill Date" in df.columns:
+        df["Refill Date"] = pd.to_datetime(df["Refill Date"], errors='coerce')
+
+    for col in STOCK_NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    return df.reset_index(drop=True)
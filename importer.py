@@ -0,0 +1,244 @@
+import io
+import itertools
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+import perf
+from health_data import HEALTH_COLUMN_MAPPING, HEALTH_SHEET_COLUMNS, VALUE_RANGES, classify_bp, classify_glucose
+
+# ✅ 批量导入：血压计/血糖仪导出的 CSV、JSON，分块读取，内存不随文件大小增长
+# Bulk import of device exports and CSV backfills, read in chunks so memory stays flat
+CHUNK_ROWS = 5000
+JSON_READ_CHARS = 1 << 16
+
+GLUCOSE = "Glucose(mmol/L)"
+GLUCOSE_MG_DL = "Glucose(mg/dL)"
+DATE_TIME = "Date Time"
+# mg/dL ÷ 18 = mmol/L
+MG_DL_PER_MMOL = 18.0
+
+TEXT_COLUMNS = ["Took Medication", "Medication", "Before/After", "Dose", "BP Note", "Glucose Note"]
+
+
+def _column_key(name):
+    return re.sub(r"\s+", " ", str(name)).strip().lower()
+
+
+# 表头别名：Sheet1 中文表头、英文列名和常见设备导出的写法
+# Header aliases: Sheet1's Chinese headers, the app's English names and common device export headers
+COLUMN_ALIASES = {
+    _column_key(alias): column for alias, column in {
+        **HEALTH_COLUMN_MAPPING,
+        **{column: column for column in HEALTH_COLUMN_MAPPING.values()},
+        "time": "Time Period",
+        "sys": "Systolic",
+        "dia": "Diastolic",
+        "heart rate": "Pulse",
+        "hr": "Pulse",
+        "glucose": GLUCOSE,
+        "blood glucose": GLUCOSE,
+        "glucose (mmol/l)": GLUCOSE,
+        "glucose(mg/dl)": GLUCOSE_MG_DL,
+        "glucose (mg/dl)": GLUCOSE_MG_DL,
+        "datetime": DATE_TIME,
+        "date/time": DATE_TIME,
+        "date time": DATE_TIME,
+        "timestamp": DATE_TIME,
+        "measured at": DATE_TIME,
+    }.items()
+}
+
+
+# ✅ 分块读取 Chunked readers; every chunk is a DataFrame of strings
+def _json_array(text, read_chars=JSON_READ_CHARS):
+    decoder = json.JSONDecoder()
+    separators = re.compile(r"[\s,]*")
+    buffer, pos, eof = "", 0, False
+    while True:
+        pos = separators.match(buffer, pos).end()
+        if buffer[pos:pos + 1] == "]" or (pos == len(buffer) and eof):
+            return
+        try:
+            if pos == len(buffer):
+                raise json.JSONDecodeError("need more data", buffer, pos)
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # 不够一条记录，再读一段 An incomplete record: read the next piece
+            more = text.read(read_chars)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield record
+
+
+# JSON 数组 [{...}, ...] 或每行一条的 JSON Lines A JSON array of objects, or JSON Lines
+def _json_records(text):
+    first = text.read(1)
+    while first.isspace():
+        first = text.read(1)
+    if first == "[":
+        yield from _json_array(text)
+    elif first:
+        for line in itertools.chain([first + text.readline()], text):
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_chunks(file, filename, chunk_rows=CHUNK_ROWS):
+    if filename.lower().endswith(".csv"):
+        yield from pd.read_csv(
+            file, dtype=str, keep_default_na=False, chunksize=chunk_rows, encoding="utf-8-sig"
+        )
+        return
+
+    text = io.TextIOWrapper(file, encoding="utf-8-sig")
+    try:
+        records = _json_records(text)
+        while True:
+            batch = list(itertools.islice(records, chunk_rows))
+            if not batch:
+                break
+            yield pd.DataFrame(batch).fillna("").astype(str)
+    finally:
+        # 不关闭上传的文件 Leave the uploaded file open
+        text.detach()
+
+
+def _text(df, column):
+    if column not in df.columns:
+        return pd.Series("", index=df.index)
+    return df[column].astype(str).str.strip()
+
+
+def _sheet_numbers(values, decimals=None):
+    if decimals is None:
+        return [int(v) if pd.notna(v) else "" for v in values]
+    return [round(float(v), decimals) if pd.notna(v) else "" for v in values]
+
+
+# 时区后缀去掉，保留记录上写的时间 UTC offsets are dropped so the time stays as written on the device
+# 年份在前的日期不受 dayfirst 影响 Year-first dates (ISO) ignore dayfirst
+def _parse_stamps(text, dayfirst):
+    text = text.str.replace(r"(?<=\d)(Z|[+-]\d{2}:?\d{2})$", "", regex=True)
+    year_first = text.str.match(r"\d{4}")
+    stamps = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+    for mask, first in ((year_first, False), (~year_first, dayfirst)):
+        if mask.any():
+            stamps[mask] = pd.to_datetime(text[mask], errors="coerce", format="mixed", dayfirst=first)
+    return stamps
+
+
+# ✅ 校验一块数据 Validate one chunk
+# 范围和表单一致，状态用同样的规则；返回 (Sheet1 行, 时间键, 被拒的行)
+# Same ranges as the form and the same status rules; returns (Sheet1 rows, timestamp keys, rejected rows)
+def validate_chunk(raw_df, dayfirst=False, first_row=1):
+    df = raw_df.rename(columns=lambda c: COLUMN_ALIASES.get(_column_key(c), c))
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    if "Date" in df.columns:
+        date_text, time_text = _text(df, "Date"), _text(df, "Time Period")
+    else:
+        # 日期和时间在同一列 Date and time in one column
+        date_text, time_text = _text(df, DATE_TIME), pd.Series("", index=df.index)
+    # 时间可能单独一列，也可能写在日期里（"2024-03-01 07:30"）The time may sit in its own column or inside the date
+    has_time = (time_text != "") | date_text.str.contains(":", regex=False)
+    stamps = _parse_stamps((date_text + " " + time_text).str.strip(), dayfirst)
+
+    raw_values = {column: _text(df, column) for column in VALUE_RANGES}
+    values = pd.DataFrame({column: pd.to_numeric(text, errors="coerce") for column, text in raw_values.items()})
+    if GLUCOSE_MG_DL in df.columns:
+        mg_dl = pd.to_numeric(_text(df, GLUCOSE_MG_DL), errors="coerce")
+        values[GLUCOSE] = values[GLUCOSE].fillna((mg_dl / MG_DL_PER_MMOL).round(1))
+        raw_values[GLUCOSE] = raw_values[GLUCOSE].where(raw_values[GLUCOSE] != "", _text(df, GLUCOSE_MG_DL))
+
+    has_bp = values["Systolic"].notna() & values["Diastolic"].notna()
+    checks = [(stamps.isna(), "日期无效 Invalid date")]
+    for column, (low, high) in VALUE_RANGES.items():
+        checks.append(((raw_values[column] != "") & values[column].isna(), f"{column} 不是数字 not a number"))
+        checks.append((values[column].notna() & ~values[column].between(low, high), f"{column} 超出范围 out of range {low}–{high}"))
+    checks.append((values["Systolic"].notna() != values["Diastolic"].notna(), "血压不完整 Incomplete BP"))
+    checks.append((~has_bp & values[GLUCOSE].isna(), "没有读数 No reading"))
+    reasons = pd.Series(
+        np.select([mask.to_numpy() for mask, _ in checks], [reason for _, reason in checks], default=""),
+        index=df.index,
+    )
+
+    valid = (reasons == "").to_numpy()
+    rejected = pd.DataFrame({
+        "Row": np.arange(first_row, first_row + len(df))[~valid],
+        "Reason": reasons[~valid].to_numpy(),
+    })
+
+    df, stamps, values, has_bp, has_time = df[valid], stamps[valid], values[valid], has_bp[valid], has_time[valid]
+    systolic, diastolic, glucose = values["Systolic"], values["Diastolic"], values[GLUCOSE]
+    sheet = pd.DataFrame({
+        "Date": stamps.dt.strftime("%Y-%m-%d"),
+        "Time Period": stamps.dt.strftime("%H:%M:%S").where(has_time, ""),
+        **{column: _text(df, column) for column in TEXT_COLUMNS},
+        "Systolic": _sheet_numbers(systolic),
+        "Diastolic": _sheet_numbers(diastolic),
+        "Pulse": _sheet_numbers(values["Pulse"]),
+        "BP Status": np.where(has_bp, classify_bp(systolic.fillna(0), diastolic.fillna(0)), ""),
+        GLUCOSE: _sheet_numbers(glucose, decimals=1),
+        "Glucose Status": np.where(glucose.notna(), classify_glucose(glucose.fillna(0)), ""),
+    }, index=df.index)
+    sheet = sheet[[HEALTH_COLUMN_MAPPING[header] for header in HEALTH_SHEET_COLUMNS]]
+
+    # 键和写入的内容一致：没有时间的记录按当天 00:00 算，和本地表的时间索引一致
+    # Keys match what is written: rows without a time key on midnight, like the local table
+    keys = stamps.where(has_time, stamps.dt.normalize()).dt.floor("s").astype("int64").to_numpy()
+    return sheet.values.tolist(), keys, rejected
+
+
+# 已排序的键里二分查找 Binary search in the sorted known keys
+def _contains(sorted_keys, keys):
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[positions] == keys
+
+
+# ✅ 导入整份文件（生成器，每块报告一次进度）Import a whole file; yields progress after each chunk
+# known_keys：已有记录的时间键，(日期, 时间) 相同的行跳过
+# known_keys: timestamp keys of existing rows; rows with the same (Date, Time) are skipped
+def import_health_file(file, filename, known_keys, write_rows, dayfirst=False, chunk_rows=CHUNK_ROWS):
+    return import_chunks(read_chunks(file, filename, chunk_rows), known_keys, write_rows, dayfirst=dayfirst)
+
+
+# 已经在内存里的记录（例如批量 OCR 的确认表）也走同样的校验和去重
+# Rows already in memory (e.g. the batch OCR review table) get the same validation and dedupe
+def import_chunks(chunks, known_keys, write_rows, dayfirst=False):
+    known = np.unique(np.asarray(known_keys, dtype="int64"))
+    first_row = 1
+    for raw_df in chunks:
+        with perf.span("import.validate"):
+            rows, keys, rejected = validate_chunk(raw_df, dayfirst=dayfirst, first_row=first_row)
+        first_row += len(raw_df)
+
+        # 跳过已有的和本文件前面出现过的 Skip rows already stored or seen earlier in this file
+        fresh = ~_contains(known, keys) & ~pd.Series(keys).duplicated().to_numpy()
+        new_rows = [row for row, keep in zip(rows, fresh) if keep]
+        if new_rows:
+            with perf.span("import.write"):
+                write_rows(new_rows)
+        new_keys = np.sort(keys[fresh])
+        known = np.insert(known, np.searchsorted(known, new_keys), new_keys)
+
+        yield {
+            "read": first_row - 1,
+            "imported": len(new_rows),
+            "duplicates": int((~fresh).sum()),
+            "rejected": rejected,
+        }
+
+
+# 本地表已有记录的时间键 Timestamp keys of a health table's rows, for deduplication
+def existing_keys(health_df):
+    if not isinstance(health_df.index, pd.DatetimeIndex):
+        return np.array([], dtype="int64")
+    return health_df.index.floor("s").as_unit("ns").asi8
@@ -0,0 +1,186 @@
+import collections
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import perf
+
+logger = logging.getLogger(__name__)
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+
+# (连接, 读取) 超时秒数 (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 60)
+MAX_RETRIES = 3
+# 整个请求（含重试和等待）最多多少秒 Overall limit for one request, retries and backoff included
+DEADLINE_SECONDS = 90
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 20
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# ✅ Groq 客户端：连接复用、超时、重试、统计
+# Groq client with a pooled session, timeouts, bounded retries and per-call metrics
+class LLMClient:
+    def __init__(self, api_key, base_url=GROQ_BASE_URL, timeout=DEFAULT_TIMEOUT,
+                 max_retries=MAX_RETRIES, deadline=DEADLINE_SECONDS, pool_size=10, metrics_size=200):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.metrics = collections.deque(maxlen=metrics_size)
+        self._metrics_lock = threading.Lock()
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(MAX_BACKOFF_SECONDS, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+    def _record(self, metric):
+        with self._metrics_lock:
+            self.metrics.append(metric)
+        logger.info(
+            "LLM %s: status=%s attempts=%d latency=%.0fms tokens=%s/%s",
+            metric["label"], metric["status"], metric["attempts"], metric["latency_ms"],
+            metric["prompt_tokens"], metric["completion_tokens"]
+        )
+
+    def recent_metrics(self):
+        with self._metrics_lock:
+            return list(self.metrics)
+
+    # 发送请求，遇到 429/5xx/连接错误时退避重试，总时间不超过 deadline
+    # POST with backoff on 429/5xx and connection errors, all within the overall deadline
+    def _post(self, path, payload, stream=False):
+        url = f"{self.base_url}{path}"
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            last_try = attempt == self.max_retries
+            # 每次尝试的超时不超过剩下的时间 Each attempt's timeouts are capped by the time left
+            remaining = deadline - time.monotonic()
+            timeout = tuple(min(t, remaining) for t in self.timeout)
+            try:
+                # 只计到响应头，流式正文另算 Timed up to the response headers; streamed bodies are read later
+                with perf.span("llm.request"):
+                    response = self.session.post(url, json=payload, timeout=timeout, stream=stream)
+            except requests.ReadTimeout as e:
+                # 服务器收到了请求却没回应，重试只会再等一轮 The server got the request and went quiet; retrying just waits again
+                raise LLMError(f"AI timed out: {e}") from e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self._backoff(attempt)
+                if last_try or time.monotonic() + delay >= deadline:
+                    raise LLMError(f"AI connection failed: {e}") from e
+                time.sleep(delay)
+                continue
+            if response.status_code in RETRYABLE_STATUS and not last_try:
+                delay = self._backoff(attempt, response)
+                if time.monotonic() + delay < deadline:
+                    response.close()
+                    time.sleep(delay)
+                    continue
+            return response, attempt + 1
+
+    # ✅ 流式聊天补全，逐段返回文字 Streamed chat completion; yields text deltas as they arrive
+    # 只在开始输出之前重试 Retries only happen before the first token
+    def chat_stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=1024, label="chat"):
+        start = time.perf_counter()
+        response, attempts = self._post("/chat/completions", {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }, stream=True)
+        metric = {
+            "label": label,
+            "model": model,
+            "status": response.status_code,
+            "attempts": attempts,
+            "first_token_ms": None,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "total_tokens": None,
+        }
+
+        try:
+            if response.status_code != 200:
+                raise LLMError(f"AI error: {response.status_code}", status_code=response.status_code)
+
+            # Server-sent events: "data: {...}" 每行一个片段，最后是 "data: [DONE]"
+            for raw_line in response.iter_lines():
+                line = raw_line.decode("utf-8")
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage")
+                if usage:
+                    metric.update(
+                        prompt_tokens=usage.get("prompt_tokens"),
+                        completion_tokens=usage.get("completion_tokens"),
+                        total_tokens=usage.get("total_tokens"),
+                    )
+                for choice in chunk.get("choices", []):
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        if metric["first_token_ms"] is None:
+                            metric["first_token_ms"] = (time.perf_counter() - start) * 1000
+                        yield delta
+        finally:
+            response.close()
+            metric["latency_ms"] = (time.perf_counter() - start) * 1000
+            self._record(metric)
+
+    # ✅ 聊天补全，返回回答文字 Chat completion; returns the answer text
+    def chat(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=1024, label="chat"):
+        start = time.perf_counter()
+        response, attempts = self._post("/chat/completions", {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        })
+        latency_ms = (time.perf_counter() - start) * 1000
+        body = response.json() if response.status_code == 200 else {}
+        usage = body.get("usage", {})
+        self._record({
+            "label": label,
+            "model": model,
+            "status": response.status_code,
+            "attempts": attempts,
+            "latency_ms": latency_ms,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "total_tokens": usage.get("total_tokens"),
+        })
+
+        if response.status_code != 200:
+            raise LLMError(f"AI error: {response.status_code}", status_code=response.status_code)
+        return body["choices"][0]["message"]["content"]
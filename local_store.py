@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from gspread.exceptions import WorksheetNotFound
+
+import perf
+from health_data import (
+    HEALTH_SHEET_COLUMNS, STOCK_SHEET_COLUMNS, normalize_health_records, normalize_stock_records, sort_by_timestamp
+)
+from sheet_sync import (
+    CACHE_DIR, apply_append, apply_cell_updates, forget_worksheet, sync_worksheet, synced_frame, worksheet_handle
+)
+
+logger = logging.getLogger(__name__)
+
+# 数据种类 → (工作表名, 整理函数) Table kind → (worksheet title, normalizer)
+TABLES = {
+    "health": ("Sheet1", normalize_health_records),
+    "stock": ("Medication Stock", normalize_stock_records),
+}
+
+# ✅ 多位病人：每人一组工作表，例如 "Sheet1 - 妈妈"、"Medication Stock - 妈妈"
+# Multiple patients: one worksheet per table kind each; the default patient keeps the original sheets
+DEFAULT_PATIENT = ""
+PATIENT_SEPARATOR = " - "
+
+# 整理后的表结构变化时加一，旧文件自动作废 Bump when the normalized layout changes so stale files are ignored
+STORE_FORMAT = 3
+
+# 后台刷新间隔（秒）Background refresh interval in seconds
+REFRESH_SECONDS = 60
+# 最近这么久有人看过的表才在后台刷新 Only tables viewed this recently are refreshed in the background
+ACTIVE_SECONDS = 15 * 60
+
+_refresh_lock = threading.Lock()
+_last_used = {}
+
+
+def worksheet_title(kind, patient=DEFAULT_PATIENT):
+    title = TABLES[kind][0]
+    return f"{title}{PATIENT_SEPARATOR}{patient}" if patient else title
+
+
+# 本地表名："health" 或 "health - 妈妈" Local table name, e.g. "health" or "health - Mum"
+def table_name(kind, patient=DEFAULT_PATIENT):
+    return f"{kind}{PATIENT_SEPARATOR}{patient}" if patient else kind
+
+
+def _table_spec(name):
+    kind, _, patient = name.partition(PATIENT_SEPARATOR)
+    return worksheet_title(kind, patient), TABLES[kind][1]
+
+
+# 工作表名 → (种类, 病人)，不认识的返回 None Worksheet title → (kind, patient), or None
+def parse_worksheet_title(title):
+    for kind, (base_title, _) in TABLES.items():
+        if title == base_title:
+            return kind, DEFAULT_PATIENT
+        prefix = f"{base_title}{PATIENT_SEPARATOR}"
+        if title.startswith(prefix) and title[len(prefix):].strip():
+            return kind, title[len(prefix):]
+    return None
+
+
+def table_for_worksheet(title):
+    parsed = parse_worksheet_title(title)
+    return table_name(*parsed) if parsed else None
+
+
+# 有健康记录表的病人 Patients that have a health records worksheet
+def patients_from_titles(titles):
+    patients = {parsed[1] for parsed in map(parse_worksheet_title, titles) if parsed and parsed[0] == "health"}
+    return sorted(patients)
+
+
+# ✅ 新增病人：建好两张带表头的工作表 Add a patient by creating both worksheets with their headers
+def create_patient(spreadsheet, patient):
+    patient = patient.strip()
+    for kind, header in (("health", HEALTH_SHEET_COLUMNS), ("stock", STOCK_SHEET_COLUMNS)):
+        title = worksheet_title(kind, patient)
+        try:
+            worksheet_handle(spreadsheet, title)
+        except WorksheetNotFound:
+            worksheet = spreadsheet.add_worksheet(title=title, rows=1000, cols=len(header))
+            worksheet.append_row(header)
+    return patient
+
+
+def table_path(spreadsheet_id, name):
+    # 病人名字可能有空格或符号 Patient names may contain spaces or symbols
+    safe_name = re.sub(r"[^\w-]+", "_", name)
+    if safe_name != name:
+        # 加上哈希避免 "a b" 和 "a_b" 撞名 A short hash keeps "a b" and "a_b" apart
+        safe_name += "_" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(CACHE_DIR, f"{spreadsheet_id}_{safe_name}.v{STORE_FORMAT}.feather")
+
+
+# ✅ 每张表有独立版本号，写入时递增；缓存按 (表, 版本) 区分
+# Each table carries its own version, bumped on every write; caches are keyed by (table, version)
+def table_version(spreadsheet_id, name):
+    try:
+        with open(f"{table_path(spreadsheet_id, name)}.version") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# ✅ 读取本地表（内存映射）Read a local table through a memory map
+def read_table(spreadsheet_id, name):
+    with perf.span("store.read"):
+        table = feather.read_table(table_path(spreadsheet_id, name), memory_map=True)
+        return table.to_pandas()
+
+
+@perf.timed("store.write")
+def write_table(spreadsheet_id, name, df):
+    path = table_path(spreadsheet_id, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # 不压缩，读取时才能直接内存映射 Uncompressed so reads can map the file directly
+    feather.write_feather(
+        pa.Table.from_pandas(df), tmp_path, compression="uncompressed"
+    )
+    os.replace(tmp_path, path)
+
+    # 先写数据再写版本号 Version is published after the data it describes
+    version = max(time.time_ns(), (table_version(spreadsheet_id, name) or 0) + 1)
+    with open(f"{path}.version.tmp", "w") as f:
+        f.write(str(version))
+    os.replace(f"{path}.version.tmp", f"{path}.version")
+    return version
+
+
+# ✅ 从 Google Sheets 同步一张表 Pull one table from Google Sheets into the local store
+def refresh_table(spreadsheet, name, force_full=False):
+    title, normalize = _table_spec(name)
+    with _refresh_lock:
+        try:
+            with perf.span("sheets.sync"):
+                worksheet = worksheet_handle(spreadsheet, title)
+                raw_df, changed = sync_worksheet(worksheet, force_full=force_full)
+        except Exception:
+            forget_worksheet(spreadsheet, title)
+            raise
+        if not changed and table_version(spreadsheet.id, name) is None:
+            # 同步状态还在但本地表没了 The sync state survived but the local table didn't
+            raw_df, _ = synced_frame(worksheet)
+        if raw_df is not None:
+            with perf.span("store.normalize"):
+                normalized = normalize(raw_df)
+            write_table(spreadsheet.id, name, normalized)
+    return table_version(spreadsheet.id, name)
+
+
+# 时间索引的表保持排序，其他表重新编号 Timestamp-indexed tables stay sorted, others are renumbered
+def concat_tables(df, new_df):
+    if isinstance(df.index, pd.DatetimeIndex) and isinstance(new_df.index, pd.DatetimeIndex):
+        return sort_by_timestamp(pd.concat([df, new_df]))
+    return pd.concat([df, new_df], ignore_index=True)
+
+
+# ✅ 写入后就地更新本地表，不再从 Google Sheets 读取
+# Patch the local table in place after our own writes instead of re-reading the sheet
+
+# 追加行：只整理新行并拼接 Appends: only the new rows are normalized and concatenated
+def patch_append(worksheet, name, rows, start_row):
+    _, normalize = _table_spec(name)
+    spreadsheet_id = worksheet.spreadsheet.id
+    with _refresh_lock:
+        appended = apply_append(worksheet, rows, start_row) if start_row else None
+        if appended is None or table_version(spreadsheet_id, name) is None:
+            return None
+        return write_table(spreadsheet_id, name, concat_tables(read_table(spreadsheet_id, name), normalize(appended)))
+
+
+# 单元格修改 [(行, 列, 值)]，整张表只重新整理一次 Cell edits; the table is normalized once per batch
+def patch_cells(worksheet, name, updates):
+    _, normalize = _table_spec(name)
+    with _refresh_lock:
+        raw_df = apply_cell_updates(worksheet, updates)
+        if raw_df is None:
+            return None
+        return write_table(worksheet.spreadsheet.id, name, normalize(raw_df))
+
+
+def patch_cell(worksheet, name, row, col, value):
+    return patch_cells(worksheet, name, [(row, col, value)])
+
+
+# 本地没有数据时（首次启动）才同步读取 Only block on Sheets when the local table doesn't exist yet
+def ensure_table(spreadsheet, name):
+    _last_used[name] = time.time()
+    version = table_version(spreadsheet.id, name)
+    if version is None:
+        version = refresh_table(spreadsheet, name)
+    return version
+
+
+def _refresh_loop(spreadsheet, stop_event, interval):
+    while not stop_event.wait(interval):
+        # 只刷新最近看过的病人，成本不随病人数增长 Only recently viewed patients, so the cost doesn't grow with patient count
+        now = time.time()
+        for name in [n for n, used in list(_last_used.items()) if now - used < ACTIVE_SECONDS]:
+            try:
+                refresh_table(spreadsheet, name)
+            except Exception:
+                logger.exception("Background refresh of %s failed", name)
+
+
+# ✅ 后台刷新线程 Background refresher thread
+def start_background_refresh(spreadsheet, interval=REFRESH_SECONDS):
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=_refresh_loop,
+        args=(spreadsheet, stop_event, interval),
+        name="local-store-refresh",
+        daemon=True,
+    )
+    thread.start()
+    return stop_event
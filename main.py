@@ -1,20 +1,42 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import gspread
 from google.oauth2 import service_account
-from twilio.rest import Client
 import datetime
 from PIL import Image
-import re
-import requests
-import io
-from google.cloud import vision
+import threading
+import local_store
+from local_store import DEFAULT_PATIENT
+import services
+import ocr
+from llm_client import GROQ_BASE_URL, LLMClient, LLMError
+from gspread.utils import rowcol_to_a1
+from sheet_sync import appended_start_row, column_number, row_index, stale_rows, synced_frame, worksheet_handle
+import outbox
+import perf
+import importer
+from health_data import (
+    HEALTH_SHEET_COLUMNS, VALUE_RANGES, classify_bp, classify_glucose, normalize_health_records, sort_by_timestamp
+)
+from stock import ROW_COLUMN, diff_stock_edits, project_stock, stock_editor_frame
+from ai_summary import build_health_summary
+from chat_context import build_messages
+from analytics import insight_lines, meal_glucose, time_of_day_means, update_analytics
+from rollups import METRICS, downsample, overall_means, rollup_view, update_rollups
 
 # 设置页面
 st.set_page_config(page_title="健康追踪器 Health Tracker", layout="wide")
 
-# ✅ Google Sheets 授权
-@st.cache_resource
+# ✅ 记录这次运行的耗时 Time this script run; summarized at the bottom of the script
+# 上一次运行被 st.stop()/st.rerun() 打断、没走到底部时，在这里补记
+# A previous run in this session that st.stop()/st.rerun() cut short is logged here instead
+if "perf_run" in st.session_state:
+    perf.finish_run(run=st.session_state["perf_run"], stopped=True)
+st.session_state["perf_run"] = perf.start_run()
+
+# ✅ 外部服务按需初始化 External clients are created on first use
+# Google Sheets 授权
 def init_google_sheets():
     creds = service_account.Credentials.from_service_account_info(
         st.secrets["gcp_service_account"],
@@ -26,85 +48,197 @@ def init_google_sheets():
     client = gspread.authorize(creds)
     return client
 
-# ✅ Google Cloud Vision 授权
-@st.cache_resource
+# 表格只打开一次，所有页面共用 The spreadsheet is opened once and shared
+def open_spreadsheet():
+    return services.get("sheets").open("BP-Glucose-Tracker")
+
+# Google Cloud Vision 授权（识别照片时才导入）Imported only when OCR runs
 def init_vision_client():
+    vision = services.timed_import("google.cloud.vision")
     creds = service_account.Credentials.from_service_account_info(
         st.secrets["gcp_service_account"]
     )
     return vision.ImageAnnotatorClient(credentials=creds)
 
+services.register("sheets", init_google_sheets)
+services.register("spreadsheet", open_spreadsheet)
+services.register("vision", init_vision_client)
+
 try:
-    gc = init_google_sheets()
-    spreadsheet = gc.open("BP-Glucose-Tracker")
-    vision_client = init_vision_client()
+    spreadsheet = services.get("spreadsheet")
 except Exception as e:
     st.error(f"❌ 连接失败：{e}")
     st.stop()
 
-# ✅ Twilio 授权
-account_sid = st.secrets["twilio"]["account_sid"]
-auth_token = st.secrets["twilio"]["auth_token"]
-twilio_client = Client(account_sid, auth_token)
-
 # ✅ Groq API 配置
 groq_api_key = st.secrets.get("groq", {}).get("api_key", "")
 
+# AI 助手的系统提示 System prompt for the AI Assistant
+ASSISTANT_SYSTEM_PROMPT = "You are a friendly health assistant helping elderly people understand their blood pressure and blood sugar data. Always respond in the SAME LANGUAGE the user asks in (English or Chinese). Use simple, easy-to-understand language and give practical advice. 你是一个友善的健康助手，帮助老年人理解他们的血压和血糖数据。请用用户提问的语言回答（英文或中文）。用简单易懂的语言，并给出实用的建议。"
+
+@perf.track_cache("init_llm_client")
+@st.cache_resource
+def init_llm_client(api_key, base_url):
+    perf.cache_miss("init_llm_client")
+    return LLMClient(api_key, base_url=base_url)
+
+llm_client = init_llm_client(groq_api_key, st.secrets.get("groq", {}).get("base_url", GROQ_BASE_URL)) if groq_api_key else None
+
+# ✅ 本地列式存储，后台从 Google Sheets 刷新 Local columnar store refreshed from Sheets in the background
+@st.cache_resource
+def start_store_refresher():
+    return local_store.start_background_refresh(spreadsheet)
+
+start_store_refresher()
+
+# ✅ 提交先写入本地队列，后台批量写入 Google Sheets Submissions go to a local outbox, flushed to Sheets in batches
+def on_outbox_flushed(worksheet, rows, start_row):
+    name = local_store.table_for_worksheet(worksheet.title)
+    if name and local_store.patch_append(worksheet, name, rows, start_row) is None:
+        local_store.refresh_table(spreadsheet, name)
+
+@st.cache_resource
+def start_outbox_worker():
+    return outbox.start_flush_worker(spreadsheet, on_flushed=on_outbox_flushed)
+
+outbox_wake = start_outbox_worker()
+
 # 读取数据
-@st.cache_data(ttl=60)
-def load_health_data():
-    worksheet = spreadsheet.worksheet("Sheet1")
-    data = worksheet.get_all_records()
-    df = pd.DataFrame(data)
-    
-    column_mapping = {
-        "日期": "Date",
-        "时间段": "Time Period",
-        "收缩压": "Systolic",
-        "舒张压": "Diastolic",
-        "血糖（mmol/L）": "Glucose(mmol/L)",
-        "脉搏": "Pulse",
-        "有吃药吗？": "Took Medication",
-        "药物名称": "Medication",
-        "饭前/饭后": "Before/After",
-        "剂量": "Dose",
-        "血压备注": "BP Note",
-        "血糖备注": "Glucose Note"
-    }
-    df.rename(columns=column_mapping, inplace=True)
-    
-    # Clean up the data
-    if "Date" in df.columns:
-        df["Date"] = pd.to_datetime(df["Date"], errors='coerce')
-        df = df.dropna(subset=["Date"])
-        df["Date"] = df["Date"].dt.strftime('%Y-%m-%d')
-    
-    # Convert numeric columns and handle empty strings
-    numeric_cols = ["Systolic", "Diastolic", "Pulse", "Glucose(mmol/L)"]
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+# 缓存按 (病人的表, 版本) 区分 Cached per (patient table, version)
+@perf.track_cache("read_store_table")
+@st.cache_data(max_entries=16)
+def read_store_table(name, version):
+    perf.cache_miss("read_store_table")
+    return local_store.read_table(spreadsheet.id, name)
+
+# ✅ 待写入的行整理一次后缓存，按队列版本增量更新
+# Queued rows are normalized once and cached; new versions only normalize rows added since
+# 写入 Sheets 的行从队首删除，所以只需去掉 id 较小的行、加上新行 Flushed rows leave from the head, so old ids are dropped and new ones added
+OUTBOX_ID = "Outbox Id"
+
+@st.cache_resource
+def pending_cache():
+    return {"lock": threading.Lock(), "frames": {}}
+
+def _normalize_pending(pending):
+    raw = pd.DataFrame([[str(v) for v in row] for _, row in pending], columns=HEALTH_SHEET_COLUMNS)
+    raw[OUTBOX_ID] = [row_id for row_id, _ in pending]
+    return normalize_health_records(raw)
+
+@perf.timed("load.pending")
+def load_pending_frame(title, version):
+    cache = pending_cache()
+    with cache["lock"]:
+        cached = cache["frames"].get(title)
+        if cached is not None and cached["version"] == version:
+            return cached["frame"]
+        count, min_id, _ = version
+        entry = None
+        if count and cached is not None and cached["version"][0]:
+            kept_ids = cached["ids"][cached["ids"] >= min_id]
+            added = outbox.pending_since(title, cached["version"][2])
+            # 行数对得上才增量，否则（例如重试了旧的行）整个重读 Incremental only when the counts line up
+            if len(kept_ids) + len(added) == count:
+                kept = cached["frame"][cached["frame"][OUTBOX_ID] >= min_id]
+                entry = {
+                    "ids": np.concatenate([kept_ids, [row_id for row_id, _ in added]]).astype("int64"),
+                    "frame": sort_by_timestamp(pd.concat([kept, _normalize_pending(added)])) if added else kept,
+                }
+        if entry is None:
+            pending = outbox.pending_since(title, 0) if count else []
+            entry = {
+                "ids": np.array([row_id for row_id, _ in pending], dtype="int64"),
+                "frame": _normalize_pending(pending) if pending else None,
+            }
+        entry["version"] = version
+        cache["frames"][title] = entry
+        return entry["frame"]
+
+@perf.timed("load.health")
+def load_health_data(patient=DEFAULT_PATIENT):
+    name = local_store.table_name("health", patient)
+    version = local_store.ensure_table(spreadsheet, name)
+    df = read_store_table(name, version)
     
-    df = df.dropna(how='all')
+    # 合并尚未写入的提交，提交后立即可见 Show queued submissions right away
+    title = local_store.worksheet_title("health", patient)
+    pending_version = outbox.pending_version(title)
+    pending_df = load_pending_frame(title, pending_version)
+    if pending_df is not None and len(pending_df):
+        with perf.span("transform.pending_merge"):
+            df = sort_by_timestamp(pd.concat([df, pending_df.drop(columns=OUTBOX_ID)]))
     
+    # 数据版本：存储版本 + 待写入行 Data version: store version plus the queued rows
+    df.attrs["data_version"] = (name, version, pending_version)
     return df
 
-@st.cache_data(ttl=60)
-def load_medication_stock():
-    stock_sheet = spreadsheet.worksheet("Medication Stock")
-    stock_data = stock_sheet.get_all_records()
-    stock_df = pd.DataFrame(stock_data)
-    
-    stock_df['Refill Date'] = pd.to_datetime(stock_df['Refill Date'])
-    stock_df['Remaining Days'] = (stock_df['Total Given'] / stock_df['Dose Per Day']).astype(int)
-    stock_df['Estimated Finish Date'] = stock_df['Refill Date'] + pd.to_timedelta(stock_df['Remaining Days'], unit='d')
-    
-    today = datetime.datetime.today()
-    stock_df['Warning'] = stock_df['Estimated Finish Date'].apply(
-        lambda x: "⚠️ 快用完了！Going to finish!" if (x - today).days <= 7 else ""
+# AI 健康摘要，每个数据版本只生成一次 AI health summary, built once per data version
+@perf.track_cache("load_health_summary")
+@st.cache_data(max_entries=4)
+def load_health_summary(data_version, _df, _insights):
+    perf.cache_miss("load_health_summary")
+    return build_health_summary(_df, _insights)
+
+# 库存预测只在任一表变化或日期变化时重新计算 Recomputed only when either table or the date changes
+@perf.track_cache("project_medication_stock")
+@st.cache_data(max_entries=8)
+def project_medication_stock(stock_name, stock_version, health_name, health_version, today):
+    perf.cache_miss("project_medication_stock")
+    return project_stock(
+        read_store_table(stock_name, stock_version),
+        read_store_table(health_name, health_version),
+        today=today
     )
-    
-    return stock_df
+
+@perf.timed("load.stock")
+def load_medication_stock(patient=DEFAULT_PATIENT):
+    stock_name = local_store.table_name("stock", patient)
+    health_name = local_store.table_name("health", patient)
+    return project_medication_stock(
+        stock_name,
+        local_store.ensure_table(spreadsheet, stock_name),
+        health_name,
+        local_store.ensure_table(spreadsheet, health_name),
+        datetime.date.today()
+    )
+
+# ✅ 图表汇总，新增记录时增量更新 Chart rollups, updated incrementally as rows are appended
+@st.cache_resource
+def rollup_cache():
+    return {"lock": threading.Lock(), "states": {}}
+
+# 每位病人各自一份汇总 One rollup state per patient
+@perf.timed("transform.rollups")
+def load_rollups(df, patient=DEFAULT_PATIENT):
+    cache = rollup_cache()
+    with cache["lock"]:
+        cache["states"][patient] = update_rollups(cache["states"].get(patient), df)
+        return cache["states"][patient]
+
+# ✅ 趋势/异常分析，同样增量更新 Trend and anomaly analytics, also updated incrementally per patient
+@st.cache_resource
+def analytics_cache():
+    return {"lock": threading.Lock(), "states": {}}
+
+@perf.timed("transform.analytics")
+def load_analytics(df, patient=DEFAULT_PATIENT):
+    cache = analytics_cache()
+    with cache["lock"]:
+        cache["states"][patient] = update_analytics(cache["states"].get(patient), df)
+        return cache["states"][patient]
+
+def in_range(column, value):
+    low, high = VALUE_RANGES[column]
+    return low <= value <= high
+
+# OCR 数值写入表单默认值，超出范围用常规值 Put OCR values into the form, falling back to typical values when out of range
+def apply_ocr_reading(reading):
+    st.session_state.ocr_systolic = reading["systolic"] if in_range("Systolic", reading["systolic"]) else 120
+    st.session_state.ocr_diastolic = reading["diastolic"] if in_range("Diastolic", reading["diastolic"]) else 80
+    st.session_state.ocr_pulse = reading["pulse"] if in_range("Pulse", reading["pulse"]) else 70
+
+# 日期列显示为 年-月-日 Show the Date column as a plain date
+RECORD_COLUMN_CONFIG = {"Date": st.column_config.DateColumn("Date", format="YYYY-MM-DD")}
 
 # 侧边栏导航
 st.sidebar.title("📱 菜单 Menu")
@@ -113,6 +247,45 @@ page = st.sidebar.radio(
     ["📝 数据输入 Data Entry", "📊 趋势图表 Charts", "💊 药物管理 Medication", "🤖 AI 助手 AI Assistant"]
 )
 
+# ✅ 选择病人，每页只读取这位病人的表 Patient selector; each page only reads this patient's tables
+@perf.track_cache("list_patients")
+@st.cache_data(ttl=300)
+def list_patients():
+    perf.cache_miss("list_patients")
+    return local_store.patients_from_titles(ws.title for ws in spreadsheet.worksheets())
+
+def patient_label(patient):
+    return patient or "本人 Me"
+
+patients = list_patients()
+if DEFAULT_PATIENT not in patients:
+    patients = [DEFAULT_PATIENT] + patients
+if "select_patient" in st.session_state:
+    st.session_state.patient = st.session_state.pop("select_patient")
+patient = st.sidebar.selectbox("👤 病人 Patient", patients, format_func=patient_label, key="patient")
+perf.tag(page=page, patient=patient)
+
+# 手动建的表可能缺药物库存表，补上（每个进程每人一次）Fill in a missing worksheet once per process
+@perf.track_cache("ensure_patient_sheets")
+@st.cache_resource
+def ensure_patient_sheets(patient):
+    perf.cache_miss("ensure_patient_sheets")
+    return local_store.create_patient(spreadsheet, patient)
+
+if patient:
+    ensure_patient_sheets(patient)
+
+with st.sidebar.expander("➕ 添加家人 Add Patient"):
+    new_patient = st.text_input("名字 Name", key="new_patient_name").strip()
+    if st.button("添加 Add", key="add_patient_button") and new_patient:
+        try:
+            local_store.create_patient(spreadsheet, new_patient)
+            list_patients.clear()
+            st.session_state.select_patient = new_patient
+            st.rerun()
+        except gspread.exceptions.APIError as e:
+            st.error(f"❌ 添加失败 Failed: {e}")
+
 if st.sidebar.checkbox("🔍 开启大字体 Large Font"):
     st.markdown('<style>body {font-size: 20px;}</style>', unsafe_allow_html=True)
 
@@ -120,16 +293,38 @@ if st.sidebar.checkbox("🔍 开启大字体 Large Font"):
 if page == "📝 数据输入 Data Entry":
     st.title("📝 健康数据输入 Health Data Entry")
     
-    df = load_health_data()
-    worksheet = spreadsheet.worksheet("Sheet1")
+    df = load_health_data(patient)
+    
+    # ✅ 被 Google Sheets 拒绝的记录：提示并让用户重试或放弃 Rows Sheets rejected: tell the user, let them retry or discard
+    health_title = local_store.worksheet_title("health", patient)
+    failed = outbox.failed_rows(health_title)
+    if failed:
+        st.error(
+            f"❌ {len(failed)} 条记录没能写入 Google Sheets "
+            f"{len(failed)} record(s) could not be saved to Google Sheets: {failed[-1][1]}"
+        )
+        with st.expander("查看这些记录 Show records"):
+            st.dataframe(
+                pd.DataFrame([[str(v) for v in row] for row, _ in failed], columns=HEALTH_SHEET_COLUMNS),
+                use_container_width=True,
+                hide_index=True
+            )
+        col_retry, col_discard = st.columns(2)
+        if col_retry.button("🔁 重试 Retry", use_container_width=True, key="retry_failed"):
+            outbox.retry_failed(health_title)
+            outbox_wake.set()
+            st.rerun()
+        if col_discard.button("🗑️ 放弃 Discard", use_container_width=True, key="discard_failed"):
+            outbox.discard_failed(health_title)
+            st.rerun()
     
     # Load medication list from stock
-    stock_df = load_medication_stock()
+    stock_df = load_medication_stock(patient)
     medication_list = ["无 None"] + stock_df['jie'].tolist() if not stock_df.empty else ["无 None"]
     
     # 显示最近记录
     st.subheader("🕒 最近记录 Latest Records")
-    st.dataframe(df.tail(5), use_container_width=True)
+    st.dataframe(df.tail(5), use_container_width=True, column_config=RECORD_COLUMN_CONFIG)
     
     st.markdown("---")
     
@@ -153,142 +348,61 @@ if page == "📝 数据输入 Data Entry":
             if st.button("🔍 识别数值 Read Numbers", use_container_width=True, key="ocr_button"):
                 with st.spinner("正在识别中 Reading..."):
                     try:
-                        # Convert PIL Image to bytes
-                        img_byte_arr = io.BytesIO()
-                        image.save(img_byte_arr, format='PNG')
-                        img_byte_arr = img_byte_arr.getvalue()
-                        
-                        # Step 1: Use Google Vision API to extract text
-                        vision_image = vision.Image(content=img_byte_arr)
-                        response = vision_client.text_detection(image=vision_image)
-                        texts = response.text_annotations
-                        
-                        if response.error.message:
-                            raise Exception(response.error.message)
+                        # Step 1: Use Google Vision API to extract text (cached by image hash)
+                        full_text, ocr_words, ocr_stats = ocr.detect_text(lambda: services.get("vision"), uploaded_image.getvalue())
                         
-                        full_text = texts[0].description if texts else ""
+                        if ocr_stats["cached"]:
+                            st.caption("⚡ 已识别过这张照片 Cached result for this photo")
+                        else:
+                            st.caption(
+                                f"📦 上传 Sent {ocr_stats['sent_bytes'] / 1024:.0f} KB "
+                                f"(原图 original {ocr_stats['original_bytes'] / 1024:.0f} KB) · "
+                                f"识别 Vision {ocr_stats['vision_ms']:.0f} ms"
+                            )
                         
                         with st.expander("🔍 查看识别结果 View Detection Results", expanded=True):
                             st.write("**识别到的文字 Detected Text:**")
                             st.code(full_text if full_text.strip() else "未检测到文字 No text detected")
                         
-                        # Step 2: Use AI to intelligently parse the text
-                        if full_text.strip() and groq_api_key:
+                        # Step 2: Parse locally; only ask the AI when the local parser isn't confident
+                        with perf.span("ocr.parse_local"):
+                            reading, confidence, method = ocr.parse_reading_locally(full_text, ocr_words)
+                        
+                        if reading and (confidence >= ocr.LOCAL_CONFIDENCE or not groq_api_key):
+                            with st.expander("📊 本地解析 Local Parse"):
+                                st.write(f"方法 Method: {method} · 置信度 Confidence: {confidence:.0%}")
+                            
+                            apply_ocr_reading(reading)
+                            st.success(f"✅ 识别成功！Systolic: {st.session_state.ocr_systolic}, Diastolic: {st.session_state.ocr_diastolic}, Pulse: {st.session_state.ocr_pulse}")
+                            st.warning("⚠️ 请向下滚动检查数值 Please scroll down to verify!")
+                        
+                        elif full_text.strip() and groq_api_key:
+                            # Step 3: Use AI to intelligently parse the text (cached by detected text)
                             st.info("🤖 AI 正在分析数字 AI analyzing numbers...")
                             
-                            ai_response = requests.post(
-                                "https://api.groq.com/openai/v1/chat/completions",
-                                headers={
-                                    "Authorization": f"Bearer {groq_api_key}",
-                                    "Content-Type": "application/json"
-                                },
-                                json={
-                                    "model": "llama-3.3-70b-versatile",
-                                    "messages": [
-                                        {
-                                            "role": "user",
-                                            "content": f"""From this text extracted from a blood pressure monitor photo, identify the blood pressure and pulse readings:
-
-Text: {full_text}
-
-IMPORTANT RULES:
-- Systolic: Look for "SYS", "S", or the HIGHER number (usually 90-200)
-- Diastolic: Look for "DIA", "D", or the LOWER number (usually 50-110)
-- Pulse: Look for "PR", "PULSE", "HR", or "P" label first. If no label, use remaining number (usually 40-150)
-
-Common formats:
-- "SYS 120 DIA 80 PR 75"
-- "120/80 PR 75"
-- "120 80 75" (systolic, diastolic, pulse in order)
-
-Respond ONLY with valid JSON, no other text:
-{{"systolic": number, "diastolic": number, "pulse": number}}
-
-If you can't find a value, use 0."""
-                                        }
-                                    ],
-                                    "temperature": 0.1,
-                                    "max_tokens": 100
-                                }
-                            )
+                            with perf.span("ocr.parse_ai"):
+                                ai_text, reading = ocr.parse_reading_with_ai(full_text, llm_client)
                             
-                            if ai_response.status_code == 200:
-                                ai_text = ai_response.json()["choices"][0]["message"]["content"]
+                            with st.expander("🤖 AI 分析 AI Analysis", expanded=True):
+                                st.write("**AI 解析结果:**")
+                                st.code(ai_text)
+                            
+                            if reading:
+                                apply_ocr_reading(reading)
                                 
-                                with st.expander("🤖 AI 分析 AI Analysis", expanded=True):
-                                    st.write("**AI 解析结果:**")
-                                    st.code(ai_text)
+                                st.success(f"""✅ AI 识别成功 AI Success! 
                                 
-                                # Parse JSON
-                                import json
-                                json_match = re.search(r'\{[^}]+\}', ai_text)
-                                if json_match:
-                                    data = json.loads(json_match.group())
-                                    
-                                    systolic_val = int(data.get('systolic', 0))
-                                    diastolic_val = int(data.get('diastolic', 0))
-                                    pulse_val = int(data.get('pulse', 0))
-                                    
-                                    # Validate and set values
-                                    if 50 <= systolic_val <= 250:
-                                        st.session_state.ocr_systolic = systolic_val
-                                    else:
-                                        st.session_state.ocr_systolic = 120
-                                        
-                                    if 30 <= diastolic_val <= 150:
-                                        st.session_state.ocr_diastolic = diastolic_val
-                                    else:
-                                        st.session_state.ocr_diastolic = 80
-                                        
-                                    if 30 <= pulse_val <= 180:
-                                        st.session_state.ocr_pulse = pulse_val
-                                    else:
-                                        st.session_state.ocr_pulse = 70
-                                    
-                                    st.success(f"""✅ AI 识别成功 AI Success! 
-                                    
 收缩压 Systolic: **{st.session_state.get('ocr_systolic', 120)}** mmHg
 舒张压 Diastolic: **{st.session_state.get('ocr_diastolic', 80)}** mmHg  
 脉搏 Pulse: **{st.session_state.get('ocr_pulse', 70)}** bpm""")
-                                    st.warning("⚠️ 请向下滚动检查并确认数值 Please scroll down and verify!")
-                                    
-                                else:
-                                    raise Exception("AI couldn't parse numbers")
-                            else:
-                                raise Exception(f"AI error: {ai_response.status_code}")
-                                
-                        else:
-                            # Fallback: Simple number extraction
-                            numbers = re.findall(r'\d+', full_text)
-                            
-                            with st.expander("📊 提取的数字 Extracted Numbers"):
-                                st.write(numbers if numbers else "无 None")
-                            
-                            if numbers and len(numbers) >= 2:
-                                num_list = [int(n) for n in numbers if n.isdigit() and len(n) <= 3]
-                                num_list.sort(reverse=True)
-                                
-                                systolic_val = 120
-                                diastolic_val = 80
-                                pulse_val = 70
-                                
-                                for num in num_list:
-                                    if 90 <= num <= 200 and systolic_val == 120:
-                                        systolic_val = num
-                                    elif 50 <= num <= 110 and diastolic_val == 80 and num < systolic_val:
-                                        diastolic_val = num
-                                    elif 40 <= num <= 150 and pulse_val == 70:
-                                        pulse_val = num
+                                st.warning("⚠️ 请向下滚动检查并确认数值 Please scroll down and verify!")
                                 
-                                st.session_state.ocr_systolic = systolic_val
-                                st.session_state.ocr_diastolic = diastolic_val
-                                st.session_state.ocr_pulse = pulse_val
-                                
-                                st.success(f"✅ 识别成功！Systolic: {systolic_val}, Diastolic: {diastolic_val}, Pulse: {pulse_val}")
-                                st.warning("⚠️ 请向下滚动检查数值 Please scroll down to verify!")
                             else:
-                                st.warning("⚠️ 无法识别数字 Cannot detect numbers")
-                                st.info("💡 建议手动输入 Please use manual entry below")
+                                raise Exception("AI couldn't parse numbers")
+                        
+                        else:
+                            st.warning("⚠️ 无法识别数字 Cannot detect numbers")
+                            st.info("💡 建议手动输入 Please use manual entry below")
                                 
                     except Exception as e:
                         st.error(f"❌ 识别错误 OCR Error: {str(e)}")
@@ -296,9 +410,131 @@ If you can't find a value, use 0."""
     
     with col_b:
         st.info("💡 **拍照小贴士 Photo Tips:**\n- 光线充足 Good lighting\n- 数字清晰 Clear numbers\n- 避免反光 No glare\n- 填满屏幕 Fill the frame")
-    
+
+    # ✅ 多张照片一次识别，检查后一次提交 Batch OCR: read many photos at once, review, then submit them together
+    with st.expander("📚 多张照片 Batch Photos"):
+        if "batch_ocr_message" in st.session_state:
+            st.success(st.session_state.pop("batch_ocr_message"))
+
+        batch_images = st.file_uploader(
+            "上传多张照片 Upload several photos",
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=True,
+            key="batch_images"
+        )
+
+        if batch_images and st.button("🔍 识别全部 Read All", use_container_width=True, key="batch_ocr_button"):
+            with st.spinner(f"正在识别 {len(batch_images)} 张照片 Reading {len(batch_images)} photos..."):
+                with perf.span("ocr.batch"):
+                    results = ocr.read_photos(
+                        lambda: services.get("vision"),
+                        [image.getvalue() for image in batch_images],
+                        llm_client=llm_client
+                    )
+
+            # 没有拍摄时间的照片用现在的时间 Photos without an EXIF time use the current time
+            now = datetime.datetime.now().replace(microsecond=0)
+            review = []
+            for position, (image, result) in enumerate(zip(batch_images, results)):
+                reading = result.get("reading") or {}
+                method = result.get("method")
+                # 按范围猜的结果里有默认值 120/80/70，不显示 The range guess fills in 120/80/70 defaults, so it's left blank
+                if method == "ranges":
+                    reading = {}
+                confident = bool(reading) and (method == "ai" or result["confidence"] >= ocr.LOCAL_CONFIDENCE)
+                if "error" in result:
+                    status = f"❌ {result['error']}"
+                elif not reading:
+                    status = "⚠️ 无法识别，请填写 Not read, please fill in"
+                elif method == "ai":
+                    status = "🤖 AI"
+                else:
+                    status = f"{method} {result['confidence']:.0%}"
+                # 没有拍摄时间的照片每张相差一秒，不会被当成重复 Photos without EXIF get distinct times so they aren't deduped
+                taken = result.get("taken")
+                if taken is None:
+                    taken = now + datetime.timedelta(seconds=position)
+                    status += " · 🕒 没有拍摄时间，请核对 No photo time, please check"
+                review.append({
+                    "Include": confident,
+                    "Photo": image.name,
+                    "Date": taken.date(),
+                    "Time": taken.time(),
+                    "Systolic": reading.get("systolic"),
+                    "Diastolic": reading.get("diastolic"),
+                    "Pulse": reading.get("pulse"),
+                    "BP Note": "",
+                    "Status": status,
+                })
+            st.session_state.batch_ocr_review = pd.DataFrame(review).astype(
+                {"Systolic": "Int64", "Diastolic": "Int64", "Pulse": "Int64"}
+            )
+
+        if "batch_ocr_review" in st.session_state:
+            with st.form("batch_ocr_form"):
+                st.caption("检查并修改数值，取消勾选的不提交 Check and fix the values; unticked rows are not submitted")
+                edited_review = st.data_editor(
+                    st.session_state.batch_ocr_review,
+                    use_container_width=True,
+                    hide_index=True,
+                    disabled=["Photo", "Status"],
+                    column_config={
+                        "Include": st.column_config.CheckboxColumn("提交 Submit"),
+                        "Date": st.column_config.DateColumn("日期 Date", format="YYYY-MM-DD"),
+                        "Time": st.column_config.TimeColumn("时间 Time", format="HH:mm:ss"),
+                        "Systolic": st.column_config.NumberColumn("收缩压 Systolic", step=1),
+                        "Diastolic": st.column_config.NumberColumn("舒张压 Diastolic", step=1),
+                        "Pulse": st.column_config.NumberColumn("脉搏 Pulse", step=1),
+                        "BP Note": st.column_config.TextColumn("血压备注 BP Note"),
+                    },
+                    key="batch_ocr_editor"
+                )
+                col_submit, col_discard = st.columns(2)
+                batch_submitted = col_submit.form_submit_button("✅ 提交 Submit", use_container_width=True)
+                batch_discarded = col_discard.form_submit_button("🗑️ 放弃 Discard", use_container_width=True)
+
+            if batch_discarded:
+                del st.session_state.batch_ocr_review
+                st.rerun()
+
+            if batch_submitted:
+                chosen = edited_review[edited_review["Include"]]
+
+                def as_text(value, fmt):
+                    return "" if value is None or pd.isna(value) else format(value, fmt)
+
+                # 和批量导入同样的校验、状态和去重 Same validation, statuses and dedupe as the bulk import
+                records = pd.DataFrame({
+                    "Date": [as_text(v, "%Y-%m-%d") for v in chosen["Date"]],
+                    "Time": [as_text(v, "%H:%M:%S") for v in chosen["Time"]],
+                    "Systolic": [as_text(v, ".0f") for v in chosen["Systolic"]],
+                    "Diastolic": [as_text(v, ".0f") for v in chosen["Diastolic"]],
+                    "Pulse": [as_text(v, ".0f") for v in chosen["Pulse"]],
+                    "BP Note": chosen["BP Note"].fillna("").astype(str).tolist(),
+                })
+                _, _, rejected = importer.validate_chunk(records)
+
+                if chosen.empty:
+                    st.warning("⚠️ 没有选择任何照片 No rows selected")
+                elif not rejected.empty:
+                    for _, problem in rejected.iterrows():
+                        st.error(f"❌ {chosen['Photo'].iloc[problem['Row'] - 1]}: {problem['Reason']}")
+                else:
+                    # 一次写入本地队列，后台用一次 append_rows 写入 One outbox write, flushed to Sheets as one append_rows batch
+                    title = local_store.worksheet_title("health", patient)
+                    summary = next(importer.import_chunks(
+                        [records], importer.existing_keys(df), lambda rows: outbox.enqueue_many(title, rows)
+                    ))
+                    outbox_wake.set()
+                    del st.session_state.batch_ocr_review
+                    st.session_state.batch_ocr_message = (
+                        f"✅ 已提交 Submitted {summary['imported']} 条记录 records"
+                        + (f" · 重复跳过 Duplicates skipped {summary['duplicates']}" if summary["duplicates"] else "")
+                    )
+                    st.rerun()
+
     st.markdown("---")
-    
+
     # 手动输入表单
     st.subheader("✍️ 手动输入 Manual Entry")
     
@@ -308,9 +544,9 @@ If you can't find a value, use 0."""
     default_pulse = st.session_state.get("ocr_pulse", 70)
     
     # Ensure defaults are within valid range
-    default_systolic = max(50, min(250, default_systolic))
-    default_diastolic = max(30, min(150, default_diastolic))
-    default_pulse = max(30, min(180, default_pulse))
+    default_systolic = max(VALUE_RANGES["Systolic"][0], min(VALUE_RANGES["Systolic"][1], default_systolic))
+    default_diastolic = max(VALUE_RANGES["Diastolic"][0], min(VALUE_RANGES["Diastolic"][1], default_diastolic))
+    default_pulse = max(VALUE_RANGES["Pulse"][0], min(VALUE_RANGES["Pulse"][1], default_pulse))
     
     with st.form("record_form"):
         col1, col2 = st.columns(2)
@@ -336,23 +572,29 @@ If you can't find a value, use 0."""
         with col2:
             systolic = st.number_input(
                 "收缩压 Systolic", 
-                min_value=50, 
-                max_value=250, 
+                min_value=VALUE_RANGES["Systolic"][0], 
+                max_value=VALUE_RANGES["Systolic"][1], 
                 value=default_systolic
             )
             diastolic = st.number_input(
                 "舒张压 Diastolic", 
-                min_value=30, 
-                max_value=150, 
+                min_value=VALUE_RANGES["Diastolic"][0], 
+                max_value=VALUE_RANGES["Diastolic"][1], 
                 value=default_diastolic
             )
             pulse = st.number_input(
                 "脉搏 Pulse", 
-                min_value=30, 
-                max_value=180, 
+                min_value=VALUE_RANGES["Pulse"][0], 
+                max_value=VALUE_RANGES["Pulse"][1], 
                 value=default_pulse
             )
-            glucose = st.number_input("血糖 Blood Sugar (mmol/L)", min_value=1.0, max_value=20.0, format="%.1f", value=5.0)
+            glucose = st.number_input(
+                "血糖 Blood Sugar (mmol/L)",
+                min_value=VALUE_RANGES["Glucose(mmol/L)"][0],
+                max_value=VALUE_RANGES["Glucose(mmol/L)"][1],
+                format="%.1f",
+                value=5.0
+            )
         
         bp_note = st.text_input("血压备注 BP Note", placeholder="例如：感觉头晕、还好等")
         glucose_note = st.text_input("血糖备注 Glucose Note", placeholder="例如：空腹后测量、饭后两小时等")
@@ -360,8 +602,8 @@ If you can't find a value, use 0."""
         submitted = st.form_submit_button("✅ 提交记录 Submit", use_container_width=True)
         
         if submitted:
-            bp_status = "高" if systolic > 140 or diastolic > 90 else "正常"
-            glucose_status = "高" if glucose > 7.8 else ("低" if glucose < 3.9 else "正常")
+            bp_status = classify_bp(systolic, diastolic)
+            glucose_status = classify_glucose(glucose)
             
             # Capture exact submission time
             submission_time = datetime.datetime.now()
@@ -372,12 +614,10 @@ If you can't find a value, use 0."""
                 took_med, medication, before_after, dose,
                 systolic, diastolic, pulse, bp_status, bp_note, glucose, glucose_status, glucose_note
             ]
-            worksheet.append_row(new_row)
+            outbox.enqueue(local_store.worksheet_title("health", patient), new_row)
+            outbox_wake.set()
             st.success(f"✅ 记录已成功提交！Submitted at {submission_time.strftime('%H:%M:%S')}")
             
-            # Clear cache and refresh
-            st.cache_data.clear()
-            
             # 清除 OCR 数据
             for key in ['ocr_systolic', 'ocr_diastolic', 'ocr_pulse']:
                 if key in st.session_state:
@@ -385,61 +625,160 @@ If you can't find a value, use 0."""
             
             # Force page refresh to show new data
             st.rerun()
+    
+    # ✅ 批量导入：设备导出或以前的记录 Bulk import of device exports and old records
+    st.markdown("---")
+    with st.expander("📥 批量导入 Bulk Import (CSV / JSON)"):
+        st.caption(
+            "日期+时间和已有记录相同的行会跳过，超出表单范围的行不导入 "
+            "Rows matching an existing date and time are skipped; values outside the form's ranges are rejected"
+        )
+        import_file = st.file_uploader("选择文件 Choose file", type=["csv", "json", "jsonl"], key="import_file")
+        dayfirst = st.checkbox("日期格式 日/月/年 Dates are day/month/year", value=True)
+        
+        if import_file and st.button("📥 导入 Import", use_container_width=True, key="import_button"):
+            title = local_store.worksheet_title("health", patient)
+            progress = st.progress(0.0)
+            totals = {"read": 0, "imported": 0, "duplicates": 0, "rejected": 0}
+            rejected_samples = []
+            try:
+                # 分块写入本地队列，后台按批次写入 Google Sheets Chunks go to the outbox; Sheets gets bounded batches
+                for step in importer.import_health_file(
+                    import_file, import_file.name, importer.existing_keys(df),
+                    lambda rows: outbox.enqueue_many(title, rows), dayfirst=dayfirst
+                ):
+                    totals["read"] = step["read"]
+                    totals["imported"] += step["imported"]
+                    totals["duplicates"] += step["duplicates"]
+                    totals["rejected"] += len(step["rejected"])
+                    if sum(len(r) for r in rejected_samples) < 100:
+                        rejected_samples.append(step["rejected"])
+                    progress.progress(
+                        min(import_file.tell() / max(import_file.size, 1), 1.0),
+                        text=f"已读取 Read {step['read']:,} 行 rows"
+                    )
+            except (ValueError, UnicodeDecodeError) as e:
+                st.error(f"❌ 文件读取失败 Could not read file: {e}")
+            
+            if totals["imported"]:
+                outbox_wake.set()
+            progress.progress(1.0)
+            st.success(
+                f"✅ 导入 Imported {totals['imported']:,} · 重复跳过 Duplicates {totals['duplicates']:,} · "
+                f"无效 Rejected {totals['rejected']:,}（共 of {totals['read']:,}）"
+            )
+            if totals["imported"]:
+                st.caption("⏳ 正在后台写入 Google Sheets Writing to Google Sheets in the background")
+            if totals["rejected"]:
+                st.write("**无效的行 Rejected rows** (第几条记录 record number)")
+                st.dataframe(pd.concat(rejected_samples).head(100), use_container_width=True, hide_index=True)
 
 # ==================== 页面 2: 趋势图表 ====================
 elif page == "📊 趋势图表 Charts":
     st.title("📊 健康趋势图表 Health Trends")
     
-    df = load_health_data()
+    df = load_health_data(patient)
     
-    if "Date" not in df.columns or df.empty:
+    if not isinstance(df.index, pd.DatetimeIndex) or df.empty:
         st.warning("⚠️ 没有数据可显示")
         st.stop()
     
-    df_sorted = df.sort_values(by="Date")
+    rollup_state = load_rollups(df, patient)
+    analytics = load_analytics(df, patient)
+    means = overall_means(rollup_state)
     
     # 统计卡片
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        avg_systolic = df["Systolic"].dropna().mean() if "Systolic" in df.columns and not df["Systolic"].dropna().empty else 0
-        st.metric("平均收缩压 Avg Systolic", f"{avg_systolic:.1f} mmHg")
+        st.metric("平均收缩压 Avg Systolic", f"{means.get('Systolic', 0):.1f} mmHg")
     
     with col2:
-        avg_diastolic = df["Diastolic"].dropna().mean() if "Diastolic" in df.columns and not df["Diastolic"].dropna().empty else 0
-        st.metric("平均舒张压 Avg Diastolic", f"{avg_diastolic:.1f} mmHg")
+        st.metric("平均舒张压 Avg Diastolic", f"{means.get('Diastolic', 0):.1f} mmHg")
     
     with col3:
-        avg_pulse = df["Pulse"].dropna().mean() if "Pulse" in df.columns and not df["Pulse"].dropna().empty else 0
-        st.metric("平均脉搏 Avg Pulse", f"{avg_pulse:.0f} bpm")
+        st.metric("平均脉搏 Avg Pulse", f"{means.get('Pulse', 0):.0f} bpm")
     
     with col4:
-        avg_glucose = df["Glucose(mmol/L)"].dropna().mean() if "Glucose(mmol/L)" in df.columns and not df["Glucose(mmol/L)"].dropna().empty else 0
-        st.metric("平均血糖 Avg Glucose", f"{avg_glucose:.1f} mmol/L")
+        st.metric("平均血糖 Avg Glucose", f"{means.get('Glucose(mmol/L)', 0):.1f} mmol/L")
     
     st.markdown("---")
     
+    # 显示粒度：原始数据或 日/周/月 汇总 Raw readings or daily/weekly/monthly rollups
+    granularity_options = {
+        "原始 Raw": None,
+        "每日 Daily": "daily",
+        "每周 Weekly": "weekly",
+        "每月 Monthly": "monthly"
+    }
+    granularity = granularity_options[st.radio("显示方式 View", list(granularity_options), horizontal=True)]
+    show_range = granularity is not None and st.checkbox("显示最高/最低 Show min/max")
+    show_average = granularity is None and st.checkbox("显示7天平均 Show 7-day average")
+    
+    if granularity is None:
+        trend_source = df[[m for m in METRICS if m in df.columns]]
+    else:
+        trend_source = rollup_view(rollup_state, granularity)
+    
+    def show_trend_chart(metrics):
+        metrics = [m for m in metrics if m in df.columns]
+        if granularity is None:
+            chart_df = trend_source[metrics].copy()
+            if show_average:
+                # 移动平均和原始数据逐行对应 The rolling averages line up row for row with the readings
+                for m in metrics:
+                    chart_df[f"{m} 7d avg"] = analytics["rolling"][f"{m} 7d"].to_numpy()
+            chart_df = chart_df.dropna(subset=metrics)
+        else:
+            stats = ["min", "mean", "max"] if show_range else ["mean"]
+            chart_df = trend_source[[(m, stat) for m in metrics for stat in stats]].dropna(how="all")
+            chart_df.columns = [f"{m} {stat}" for m, stat in chart_df.columns]
+        
+        if metrics and not chart_df.empty:
+            # 点数有上限，历史再长也不会拖慢浏览器 Bounded point count regardless of history length
+            with perf.span("transform.downsample"):
+                chart_df = downsample(chart_df)
+            with perf.span("render.chart"):
+                st.line_chart(chart_df)
+        else:
+            st.info("📊 暂无数据 No data available")
+    
     # 图表
     st.subheader("🫀 血压趋势 Blood Pressure Trend")
-    chart_df = df_sorted[["Date", "Systolic", "Diastolic"]].dropna()
-    if not chart_df.empty:
-        st.line_chart(chart_df.set_index("Date"))
-    else:
-        st.info("📊 暂无数据 No data available")
+    show_trend_chart(["Systolic", "Diastolic"])
     
     st.subheader("💓 脉搏趋势 Pulse Trend")
-    pulse_df = df_sorted[["Date", "Pulse"]].dropna()
-    if not pulse_df.empty:
-        st.line_chart(pulse_df.set_index("Date"))
-    else:
-        st.info("📊 暂无数据 No data available")
+    show_trend_chart(["Pulse"])
     
     st.subheader("🍬 血糖趋势 Blood Sugar Trend")
-    glucose_df = df_sorted[["Date", "Glucose(mmol/L)"]].dropna()
-    if not glucose_df.empty:
-        st.line_chart(glucose_df.set_index("Date"))
-    else:
-        st.info("📊 暂无数据 No data available")
+    show_trend_chart(["Glucose(mmol/L)"])
+    
+    # ✅ 分析 Insights
+    st.markdown("---")
+    st.subheader("🔎 分析 Insights")
+    
+    for _, episode in analytics["sustained"].iterrows():
+        st.warning(
+            f"⚠️ {episode['Kind']}: 连续 {episode['Days']} 天 days in a row "
+            f"({episode['Start']:%Y-%m-%d} → {episode['End']:%Y-%m-%d})"
+        )
+    
+    col_insight1, col_insight2 = st.columns(2)
+    with col_insight1:
+        st.write("**🕒 早晚比较 By Time of Day**")
+        st.dataframe(time_of_day_means(analytics).round(1), use_container_width=True)
+    with col_insight2:
+        st.write("**🍚 饭前/饭后血糖 Glucose by Meal**")
+        meals = meal_glucose(analytics)
+        if meals.empty:
+            st.info("📊 暂无数据 No data available")
+        for label, row in meals.iterrows():
+            st.metric(label, f"{row['mean']:.1f} mmol/L", help=f"{row['count']:.0f} 笔 readings")
+    
+    outliers = analytics["outliers"]
+    with st.expander(f"📍 异常读数 Unusual Readings ({len(outliers)})"):
+        st.caption("和之前的记录相比相差很大的读数 Readings far from your usual values")
+        st.dataframe(outliers.sort_index(ascending=False).round(1), use_container_width=True)
     
     # 完整数据表
     st.markdown("---")
@@ -448,23 +787,23 @@ elif page == "📊 趋势图表 Charts":
     # 日期筛选
     col_filter1, col_filter2 = st.columns(2)
     with col_filter1:
-        start_date = st.date_input("开始日期 Start Date", value=pd.to_datetime(df["Date"].min()))
+        start_date = st.date_input("开始日期 Start Date", value=df.index.min().date())
     with col_filter2:
-        end_date = st.date_input("结束日期 End Date", value=pd.to_datetime(df["Date"].max()))
+        end_date = st.date_input("结束日期 End Date", value=df.index.max().date())
     
-    filtered_df = df[
-        (pd.to_datetime(df["Date"]) >= pd.to_datetime(start_date)) & 
-        (pd.to_datetime(df["Date"]) <= pd.to_datetime(end_date))
-    ]
+    # 时间索引已排序，按日期切片是二分查找 Sorted timestamp index: the date slice is a binary search
+    filtered_df = df.loc[start_date.isoformat():end_date.isoformat()]
     
-    st.dataframe(filtered_df, use_container_width=True)
+    st.dataframe(filtered_df, use_container_width=True, column_config=RECORD_COLUMN_CONFIG)
 
 # ==================== 页面 3: 药物管理 ====================
 elif page == "💊 药物管理 Medication":
     st.title("💊 药物库存管理 Medication Management")
     
-    stock_df = load_medication_stock()
-    stock_sheet = spreadsheet.worksheet("Medication Stock")
+    stock_df = load_medication_stock(patient)
+    # 缓存的句柄，不再每次读取元数据 Cached handle: no metadata fetch per rerun
+    stock_table = local_store.table_name("stock", patient)
+    stock_sheet = worksheet_handle(spreadsheet, local_store.worksheet_title("stock", patient))
     
     # 显示库存
     st.subheader("📦 当前库存 Current Stock")
@@ -474,7 +813,7 @@ elif page == "💊 药物管理 Medication":
     )
     
     # 快用完提醒
-    urgent_meds = stock_df[stock_df['Warning'] != ""]
+    urgent_meds = stock_df[stock_df['Warning'] != ""].sort_values('Estimated Finish Date')
     if not urgent_meds.empty:
         st.error("⚠️ 以下药物快用完了！These medications are running low!")
         st.dataframe(urgent_meds[['jie', 'Estimated Finish Date']], use_container_width=True)
@@ -494,9 +833,11 @@ elif page == "💊 药物管理 Medication":
             
             if st.button("添加 Add", use_container_width=True):
                 new_row = [new_med_name, new_refill_date.strftime("%Y-%m-%d"), new_total, new_dose, new_note]
-                stock_sheet.append_row(new_row)
+                response = stock_sheet.append_row(new_row)
+                # 只更新药物库存表的缓存 Only the medication table's cache is patched
+                if local_store.patch_append(stock_sheet, stock_table, [new_row], appended_start_row(response)) is None:
+                    local_store.refresh_table(spreadsheet, stock_table)
                 st.success("✅ 药物记录已添加 Done!")
-                st.cache_data.clear()
                 st.rerun()
     
     # 修改剂量
@@ -507,23 +848,105 @@ elif page == "💊 药物管理 Medication":
             new_dose_edit = st.number_input("新的每日剂量 New Daily Dose", min_value=0.0, step=0.1)
             
             if st.button("更新剂量 Update", use_container_width=True):
-                cell = stock_sheet.find(selected_med)
-                if cell:
-                    row_num = cell.row
-                    stock_sheet.update_cell(row_num, 4, new_dose_edit)
+                # 用本地行号索引代替 find()，直接写入单元格 Local row index instead of a find() round trip
+                med_name = str(selected_med).strip()
+                row_num = (row_index(stock_sheet, "jie") or {}).get(med_name)
+                # 写入前确认那一行还是这个药物（表格里可能排过序或插入了行），不是就完整同步一次
+                # Confirm the row still holds this medication (the sheet may have been sorted or had rows inserted);
+                # if not, resync fully and look it up again
+                if row_num is None or stale_rows(stock_sheet, {row_num}):
+                    local_store.refresh_table(spreadsheet, stock_table, force_full=True)
+                    row_num = (row_index(stock_sheet, "jie") or {}).get(med_name)
+                dose_col = column_number(stock_sheet, "Dose Per Day") or 4
+                if row_num:
+                    stock_sheet.update_cell(row_num, dose_col, new_dose_edit)
+                    if local_store.patch_cell(stock_sheet, stock_table, row_num, dose_col, new_dose_edit) is None:
+                        local_store.refresh_table(spreadsheet, stock_table, force_full=True)
                     st.success(f"✅ {selected_med} 剂量已更新 Dose updated!")
-                    st.cache_data.clear()
                     st.rerun()
+                else:
+                    st.warning("找不到这个药物，请稍后再试 Medication not found in the sheet, please try again")
+    
+    # ✅ 批量管理：表格内编辑，本地比较后一次写回 Batch edit: diffed locally, written back in one call
+    st.markdown("---")
+    st.subheader("📋 批量管理 Batch Edit")
+    raw_stock, stock_revision = synced_frame(stock_sheet)
+    if raw_stock is None:
+        local_store.refresh_table(spreadsheet, stock_table)
+        raw_stock, stock_revision = synced_frame(stock_sheet)
+    
+    # 表格显示会话里保存的快照，保存时和它比较；有已提交但没保存的修改时不换成新数据
+    # The grid shows a snapshot kept in session state and saves diff against it;
+    # it isn't swapped for newer data while submitted edits are still pending
+    snapshot = st.session_state.get("stock_editor_snapshot")
+    editor_state = st.session_state.get("stock_batch_editor") or {}
+    pending_edits = any(editor_state.get(key) for key in ("edited_rows", "added_rows", "deleted_rows"))
+    if snapshot is None or (snapshot["revision"] != stock_revision and not pending_edits):
+        snapshot = {"raw": raw_stock, "frame": stock_editor_frame(raw_stock), "revision": stock_revision}
+        st.session_state.stock_editor_snapshot = snapshot
+    stock_header = list(snapshot["raw"].columns)
+    base_stock = snapshot["frame"]
+    
+    if "stock_editor_error" in st.session_state:
+        st.error(st.session_state.pop("stock_editor_error"))
+    
+    with st.form("stock_batch_form"):
+        edited_stock = st.data_editor(
+            base_stock,
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                ROW_COLUMN: None,
+                "Refill Date": st.column_config.DateColumn("Refill Date", format="YYYY-MM-DD"),
+            },
+            key="stock_batch_editor"
+        )
+        save_all = st.form_submit_button("💾 保存全部 Save All", use_container_width=True)
+    
+    if save_all:
+        changes = diff_stock_edits(base_stock, edited_stock, stock_header)
+        if changes["deleted"]:
+            st.warning("⚠️ 这里不能删除药物，请在 Google Sheets 删除 Deleting rows isn't supported here; remove them in Google Sheets")
+        if changes["invalid"]:
+            st.error(f"❌ 新增的第 {', '.join(map(str, changes['invalid']))} 行缺少药物名称 New rows are missing a medication name")
+        elif not changes["updates"] and not changes["appends"]:
+            del st.session_state.stock_editor_snapshot
+            st.info("没有修改 No changes to save")
+        else:
+            touched_rows = {row for row, _, _ in changes["updates"]}
+            # 改过的行和表格里现在的内容比较 Edited rows are checked against what the sheet holds now
+            conflicts = stale_rows(stock_sheet, touched_rows, frame=snapshot["raw"]) if touched_rows else []
+            del st.session_state.stock_editor_snapshot
+            if conflicts:
+                # 别人在你编辑时改了表格 Someone changed the sheet meanwhile; reload and let the user review
+                local_store.refresh_table(spreadsheet, stock_table, force_full=True)
+                st.session_state.stock_editor_error = f"⚠️ 第 {', '.join(map(str, conflicts))} 行在你编辑时被修改了，已重新载入，请检查后再保存 These rows changed in the sheet while you were editing; reloaded, please review and save again"
+                st.rerun()
+            else:
+                if changes["updates"]:
+                    stock_sheet.batch_update(
+                        [{"range": rowcol_to_a1(row, col), "values": [[value]]} for row, col, value in changes["updates"]],
+                        value_input_option="USER_ENTERED"
+                    )
+                    if local_store.patch_cells(stock_sheet, stock_table, changes["updates"]) is None:
+                        local_store.refresh_table(spreadsheet, stock_table, force_full=True)
+                if changes["appends"]:
+                    response = stock_sheet.append_rows(changes["appends"])
+                    if local_store.patch_append(stock_sheet, stock_table, changes["appends"], appended_start_row(response)) is None:
+                        local_store.refresh_table(spreadsheet, stock_table)
+                st.success(f"✅ 已更新 {len(changes['updates'])} 格，新增 {len(changes['appends'])} 种药物 Saved {len(changes['updates'])} cell edits and {len(changes['appends'])} new medications")
+                st.rerun()
 
 # ==================== 页面 4: AI 助手 ====================
 elif page == "🤖 AI 助手 AI Assistant":
     st.title("🤖 AI 健康助手 AI Health Assistant")
     st.write("问我关于你的健康数据！Ask me about your health data!")
     
-    df = load_health_data()
+    df = load_health_data(patient)
     
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+    # 每位病人各自的对话 Separate conversation per patient
+    chat_history = st.session_state.setdefault("chat_histories", {}).setdefault(patient, [])
     
     # 问答区
     user_question = st.text_input(
@@ -535,69 +958,96 @@ elif page == "🤖 AI 助手 AI Assistant":
         if not groq_api_key:
             st.warning("⚠️ 请在 secrets.toml 添加 Groq API key")
         else:
-            with st.spinner("🤔 AI 正在分析中 Analyzing..."):
-                # 准备健康数据摘要
-                recent_data = df.tail(10).to_string()
-                
-                avg_systolic = df["Systolic"].dropna().mean() if "Systolic" in df.columns and not df["Systolic"].dropna().empty else 0
-                avg_diastolic = df["Diastolic"].dropna().mean() if "Diastolic" in df.columns and not df["Diastolic"].dropna().empty else 0
-                avg_glucose = df["Glucose(mmol/L)"].dropna().mean() if "Glucose(mmol/L)" in df.columns and not df["Glucose(mmol/L)"].dropna().empty else 0
+            # 准备健康数据摘要
+            health_summary = load_health_summary(
+                df.attrs["data_version"], df, insight_lines(load_analytics(df, patient))
+            )
+            
+            try:
+                # 流式显示，第一个字出来就开始显示 Stream the answer so the first words show up right away
+                # 标题等第一个字到了才显示，请求失败时只显示错误 The header waits for the first token, so a failed request shows only the error
+                response_header = st.empty()
                 
-                health_summary = f"""
-用户最近的健康数据：
-- 平均收缩压 Avg Systolic: {avg_systolic:.1f} mmHg
-- 平均舒张压 Avg Diastolic: {avg_diastolic:.1f} mmHg
-- 平均血糖 Avg Blood Sugar: {avg_glucose:.1f} mmol/L
-
-最近10笔记录 Recent 10 records：
-{recent_data}
-"""
+                def with_header(chunks):
+                    for i, chunk in enumerate(chunks):
+                        if i == 0:
+                            response_header.success("✅ AI 回答 AI Response:")
+                        yield chunk
                 
-                try:
-                    response = requests.post(
-                        "https://api.groq.com/openai/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {groq_api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "llama-3.3-70b-versatile",
-                            "messages": [
-                                {
-                                    "role": "system",
-                                    "content": "You are a friendly health assistant helping elderly people understand their blood pressure and blood sugar data. Always respond in the SAME LANGUAGE the user asks in (English or Chinese). Use simple, easy-to-understand language and give practical advice. 你是一个友善的健康助手，帮助老年人理解他们的血压和血糖数据。请用用户提问的语言回答（英文或中文）。用简单易懂的语言，并给出实用的建议。"
-                                },
-                                {
-                                    "role": "user",
-                                    "content": f"{health_summary}\n\nUser Question: {user_question}"
-                                }
-                            ],
-                            "temperature": 0.7,
-                            "max_tokens": 1024
-                        }
-                    )
-                    
-                    if response.status_code == 200:
-                        ai_response = response.json()["choices"][0]["message"]["content"]
-                        st.session_state.chat_history.append({"user": user_question, "ai": ai_response})
-                        st.success("✅ AI 回答 AI Response:")
-                        st.write(ai_response)
-                    else:
-                        st.error(f"❌ API 错误 Error: {response.status_code}")
-                except Exception as e:
+                messages, context_stats = build_messages(
+                    ASSISTANT_SYSTEM_PROMPT, health_summary, chat_history, user_question
+                )
+                with perf.span("llm.chat_stream"):
+                    ai_response = st.write_stream(with_header(llm_client.chat_stream(
+                        messages,
+                        temperature=0.7,
+                        max_tokens=1024,
+                        label="assistant"
+                    )))
+                st.caption(
+                    f"🧮 提示约 Prompt ≈ {context_stats['prompt_tokens']} tokens · "
+                    f"带上 {context_stats['turns_included']} 轮对话 turns of history"
+                )
+                chat_history.append({
+                    "user": user_question,
+                    "ai": ai_response,
+                    "prompt_tokens": context_stats["prompt_tokens"]
+                })
+            except LLMError as e:
+                if e.status_code:
+                    st.error(f"❌ API 错误 Error: {e.status_code}")
+                else:
                     st.error(f"❌ 连接失败 Failed: {e}")
+            except Exception as e:
+                st.error(f"❌ 连接失败 Failed: {e}")
     
     # 显示聊天历史
-    if st.session_state.chat_history:
+    if chat_history:
         st.markdown("---")
         st.subheader("📜 聊天记录 Chat History")
         
-        for i, chat in enumerate(reversed(st.session_state.chat_history)):
+        for i, chat in enumerate(reversed(chat_history)):
             with st.container():
                 st.markdown(f"**🙋 你 You:** {chat['user']}")
                 st.markdown(f"**🤖 AI:** {chat['ai']}")
                 st.markdown("---")
         
         if st.button("🗑️ 清除历史 Clear History"):
-            st.session_state.chat_history = []
+            chat_history.clear()
             st.rerun()
+
+# ✅ 运行汇总：写一行 JSON 日志；配置了 [admin] token 且网址带 ?admin=<token> 时侧边栏显示性能面板
+# Run summary: one JSON log line per run; the sidebar panel needs a configured [admin] token and ?admin=<token>
+run_summary = perf.finish_run()
+admin_token = str(st.secrets.get("admin", {}).get("token", ""))
+if admin_token and st.query_params.get("admin") == admin_token:
+    with st.sidebar.expander("⏱️ 性能 Performance", expanded=True):
+        st.caption(f"本次运行 This run: {run_summary['total_ms']:.0f} ms")
+        if run_summary["spans"]:
+            st.dataframe(
+                pd.DataFrame(run_summary["spans"]).T.sort_values("ms", ascending=False),
+                use_container_width=True
+            )
+        if run_summary["cache"]:
+            st.write("**缓存 Cache hits/misses**")
+            st.dataframe(pd.DataFrame(run_summary["cache"]).T, use_container_width=True)
+        
+        recent = perf.recent_runs()
+        st.write(f"**最近 {len(recent)} 次运行 Recent runs (ms)**")
+        st.dataframe(
+            pd.DataFrame([{"page": r.get("page"), "total_ms": r["total_ms"], "stopped": r.get("stopped", False)}
+                          for r in reversed(recent)]),
+            use_container_width=True
+        )
+        
+        st.write("**进程累计 Process totals (incl. background)**")
+        st.dataframe(
+            pd.DataFrame(perf.totals()).T.round(1).sort_values("ms", ascending=False),
+            use_container_width=True
+        )
+        st.write("**服务初始化 Service init**")
+        st.json(services.timings(), expanded=False)
+        if llm_client:
+            st.write("**AI 请求 AI requests**")
+            st.dataframe(pd.DataFrame(llm_client.recent_metrics()), use_container_width=True)
+        st.caption(f"日志 Log: {perf.PERF_LOG_PATH}")
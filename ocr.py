@@ -0,0 +1,408 @@
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageFilter, ImageOps
+
+import perf
+from sheet_sync import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# ✅ OCR 结果缓存（按内容哈希，磁盘 LRU）OCR result cache keyed by content hash, LRU-evicted on disk
+OCR_CACHE_PATH = os.path.join(CACHE_DIR, "ocr_cache.sqlite3")
+OCR_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+
+def _connect(path=OCR_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS ocr_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        )"""
+    )
+    return conn
+
+
+def content_key(kind, data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return f"{kind}:{hashlib.sha256(data).hexdigest()}"
+
+
+def cache_get(key, path=OCR_CACHE_PATH):
+    with _connect(path) as conn:
+        row = conn.execute("SELECT value FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+
+def cache_put(key, value, path=OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES):
+    payload = json.dumps(value, ensure_ascii=False)
+    with _connect(path) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ocr_cache (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, payload, len(payload.encode("utf-8")), time.time()),
+        )
+        # 超过容量时删除最久未用的 Evict least recently used entries beyond the size budget
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        if total > max_bytes:
+            evict = []
+            for old_key, size in conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_used"):
+                if total <= max_bytes:
+                    break
+                evict.append((old_key,))
+                total -= size
+            conn.executemany("DELETE FROM ocr_cache WHERE key = ?", evict)
+
+
+# ✅ 图片预处理，缩小上传给 Vision 的数据 Preprocess photos to shrink the Vision payload
+# 数字识别不需要全分辨率 Digit OCR doesn't need full phone resolution
+OCR_MAX_SIDE = 1600
+# 小于此大小且方向正确的 JPEG/PNG 原样上传 Small, upright JPEG/PNG uploads are sent untouched
+PASSTHROUGH_BYTES = 512 * 1024
+OCR_JPEG_QUALITY = 85
+# 内容区域小于整张图的这个比例才裁剪 Only crop when the content box is clearly smaller than the photo
+CROP_MAX_AREA = 0.8
+EDGE_THRESHOLD = 40
+
+
+def _needs_rotation(image):
+    try:
+        return image.getexif().get(0x0112, 1) != 1
+    except Exception:
+        return False
+
+
+# 按边缘找出显示屏/文字区域 Find the display/text region from its edges
+def _crop_to_content(gray):
+    probe = gray.copy()
+    probe.thumbnail((400, 400))
+    # 滤镜不处理最外一圈像素，去掉 The edge filter leaves the 1px border untouched, so drop it
+    edges = probe.filter(ImageFilter.FIND_EDGES).crop((1, 1, probe.width - 1, probe.height - 1))
+    box = edges.point(lambda p: 255 if p > EDGE_THRESHOLD else 0).getbbox()
+    if not box:
+        return gray
+
+    scale_x = gray.width / probe.width
+    scale_y = gray.height / probe.height
+    left, top, right, bottom = (v + 1 for v in box)
+    margin_x = (right - left) * 0.05
+    margin_y = (bottom - top) * 0.05
+    box = (
+        max(0, int((left - margin_x) * scale_x)),
+        max(0, int((top - margin_y) * scale_y)),
+        min(gray.width, int((right + margin_x) * scale_x)),
+        min(gray.height, int((bottom + margin_y) * scale_y)),
+    )
+    if (box[2] - box[0]) * (box[3] - box[1]) > CROP_MAX_AREA * gray.width * gray.height:
+        return gray
+    return gray.crop(box)
+
+
+# 返回 (上传内容, 统计) Returns (bytes to send, stats)
+def prepare_image(image_bytes):
+    image = Image.open(io.BytesIO(image_bytes))
+    stats = {"original_bytes": len(image_bytes), "original_size": image.size}
+
+    if (
+        image.format in ("JPEG", "PNG")
+        and len(image_bytes) <= PASSTHROUGH_BYTES
+        and max(image.size) <= OCR_MAX_SIDE
+        and not _needs_rotation(image)
+    ):
+        stats.update(sent_bytes=len(image_bytes), sent_size=image.size, passthrough=True)
+        return image_bytes, stats
+
+    image = ImageOps.exif_transpose(image).convert("L")
+    image = _crop_to_content(image)
+    image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format="JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+    payload = img_byte_arr.getvalue()
+    stats.update(sent_bytes=len(payload), sent_size=image.size, passthrough=False)
+    return payload, stats
+
+
+# ✅ Google Vision 文字识别（同一张照片只识别一次）Vision text detection, once per distinct photo
+# get_vision_client 只在没有缓存时调用 get_vision_client is only called on a cache miss
+# 返回 (文字, 单词及位置, 统计) Returns (detected text, words with boxes, stats incl. bytes sent and latency)
+def detect_text(get_vision_client, image_bytes):
+    key = content_key("image", image_bytes)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached["text"], cached.get("words", []), {"cached": True, "original_bytes": len(image_bytes)}
+
+    start = time.perf_counter()
+    with perf.span("ocr.preprocess"):
+        payload, stats = prepare_image(image_bytes)
+    stats["preprocess_ms"] = (time.perf_counter() - start) * 1000
+
+    vision_client = get_vision_client()
+    # 创建客户端时已经导入，这里不再耗时 Already imported while creating the client
+    from google.cloud import vision
+
+    start = time.perf_counter()
+    vision_image = vision.Image(content=payload)
+    with perf.span("ocr.vision"):
+        response = vision_client.text_detection(image=vision_image)
+    stats["vision_ms"] = (time.perf_counter() - start) * 1000
+    stats["cached"] = False
+    logger.info(
+        "Vision OCR: sent %d of %d bytes, preprocess %.0f ms, vision %.0f ms",
+        stats["sent_bytes"], stats["original_bytes"], stats["preprocess_ms"], stats["vision_ms"]
+    )
+    texts = response.text_annotations
+
+    if response.error.message:
+        raise Exception(response.error.message)
+
+    full_text = texts[0].description if texts else ""
+    words = [_word_box(t) for t in texts[1:]]
+    cache_put(key, {"text": full_text, "words": words})
+    return full_text, words, stats
+
+
+# 单词和它的位置 [文字, 左, 上, 高] A word and its box as [text, left, top, height]
+def _word_box(annotation):
+    xs = [v.x for v in annotation.bounding_poly.vertices]
+    ys = [v.y for v in annotation.bounding_poly.vertices]
+    return [annotation.description, min(xs), min(ys), max(ys) - min(ys)]
+
+
+# ✅ 本地解析（不调用 AI）Local deterministic parser; the LLM is only used below this confidence
+LOCAL_CONFIDENCE = 0.75
+
+_LABELS = {
+    "systolic": r"SYS|SYST|S",
+    "diastolic": r"DIA|DIAS|D",
+    "pulse": r"PULSE|PUL|PR|HR|P",
+}
+_ANY_LABEL = r"SYS|DIA|PUL|PR|HR"
+# 标签后面跟着的数字（中间不能有别的标签）A number after its label, with no other label in between
+_LABEL_PATTERNS = {
+    name: re.compile(rf"\b(?:{label})\b(?:(?!{_ANY_LABEL})\D){{0,12}}?(\d{{2,3}})\b", re.IGNORECASE)
+    for name, label in _LABELS.items()
+}
+_SLASH_PATTERN = re.compile(r"\b(\d{2,3})\s*/\s*(\d{2,3})\b")
+_NUMBER_PATTERN = re.compile(r"\b\d{2,3}\b")
+
+
+def is_plausible(reading):
+    return (
+        50 <= reading["systolic"] <= 250
+        and 30 <= reading["diastolic"] <= 150
+        and 30 <= reading["pulse"] <= 180
+        and reading["systolic"] > reading["diastolic"]
+    )
+
+
+def _numbers(text):
+    return [int(n) for n in _NUMBER_PATTERN.findall(text)]
+
+
+def _parse_labelled(text):
+    found = {}
+    for name, pattern in _LABEL_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            found[name] = int(match.group(1))
+    if len(found) == 3:
+        return found, 0.95
+    return None, 0
+
+
+def _parse_slash(text):
+    match = _SLASH_PATTERN.search(text)
+    if not match:
+        return None, 0
+    reading = {"systolic": int(match.group(1)), "diastolic": int(match.group(2))}
+    pulse = _LABEL_PATTERNS["pulse"].search(text)
+    if pulse:
+        return dict(reading, pulse=int(pulse.group(1))), 0.9
+    rest = _numbers(text[:match.start()] + " " + text[match.end():])
+    if len(rest) == 1:
+        return dict(reading, pulse=rest[0]), 0.8
+    return dict(reading, pulse=0), 0.5
+
+
+# 血压计屏幕上三个大数字从上到下是 收缩压/舒张压/脉搏
+# Monitor displays stack the three large numbers top to bottom: systolic, diastolic, pulse
+def _parse_layout(words):
+    numbers = [w for w in words if re.fullmatch(r"\d{2,3}", w[0])]
+    if len(numbers) < 3:
+        return None, 0
+    by_height = sorted(numbers, key=lambda w: w[3], reverse=True)
+    systolic, diastolic, pulse = (int(w[0]) for w in sorted(by_height[:3], key=lambda w: w[2]))
+    # 日期、时间等小字比读数小得多 Dates/clock digits are much smaller than the reading
+    separated = len(numbers) == 3 or by_height[2][3] > 1.5 * by_height[3][3]
+    confidence = 0.85 if separated else 0.6
+    return {"systolic": systolic, "diastolic": diastolic, "pulse": pulse}, confidence
+
+
+def _parse_in_order(text):
+    numbers = _numbers(text)
+    if len(numbers) == 3:
+        return dict(zip(("systolic", "diastolic", "pulse"), numbers)), 0.8
+    return None, 0
+
+
+# 最后的办法：按数值范围猜 Last resort: guess from value ranges
+def _parse_by_range(text):
+    num_list = sorted(_numbers(text), reverse=True)
+    if len(num_list) < 2:
+        return None, 0
+
+    systolic_val = 120
+    diastolic_val = 80
+    pulse_val = 70
+
+    for num in num_list:
+        if 90 <= num <= 200 and systolic_val == 120:
+            systolic_val = num
+        elif 50 <= num <= 110 and diastolic_val == 80 and num < systolic_val:
+            diastolic_val = num
+        elif 40 <= num <= 150 and pulse_val == 70:
+            pulse_val = num
+
+    return {"systolic": systolic_val, "diastolic": diastolic_val, "pulse": pulse_val}, 0.4
+
+
+# 返回 (数值或 None, 置信度, 方法) Returns (reading or None, confidence, method)
+def parse_reading_locally(full_text, words=None):
+    parsers = [
+        ("labels", lambda: _parse_labelled(full_text)),
+        ("slash", lambda: _parse_slash(full_text)),
+        ("layout", lambda: _parse_layout(words or [])),
+        ("order", lambda: _parse_in_order(full_text)),
+        ("ranges", lambda: _parse_by_range(full_text)),
+    ]
+    best = (None, 0, None)
+    for method, parse in parsers:
+        reading, confidence = parse()
+        if reading is None:
+            continue
+        if not is_plausible(reading):
+            confidence = min(confidence, 0.3)
+        if confidence > best[1]:
+            best = (reading, confidence, method)
+        if confidence >= LOCAL_CONFIDENCE:
+            break
+    return best
+
+
+OCR_PROMPT = """From this text extracted from a blood pressure monitor photo, identify the blood pressure and pulse readings:
+
+Text: {full_text}
+
+IMPORTANT RULES:
+- Systolic: Look for "SYS", "S", or the HIGHER number (usually 90-200)
+- Diastolic: Look for "DIA", "D", or the LOWER number (usually 50-110)
+- Pulse: Look for "PR", "PULSE", "HR", or "P" label first. If no label, use remaining number (usually 40-150)
+
+Common formats:
+- "SYS 120 DIA 80 PR 75"
+- "120/80 PR 75"
+- "120 80 75" (systolic, diastolic, pulse in order)
+
+Respond ONLY with valid JSON, no other text:
+{{"systolic": number, "diastolic": number, "pulse": number}}
+
+If you can't find a value, use 0."""
+
+
+# ✅ AI 解析数值（同样的文字只问一次）AI parsing of the detected text, once per distinct text
+# 返回 (AI 原文, 数值或 None) Returns (raw AI answer, reading dict or None)
+def parse_reading_with_ai(full_text, llm_client):
+    key = content_key("text", full_text)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached["ai_text"], cached["reading"]
+
+    ai_text = llm_client.chat(
+        [
+            {
+                "role": "user",
+                "content": OCR_PROMPT.format(full_text=full_text)
+            }
+        ],
+        temperature=0.1,
+        max_tokens=100,
+        label="ocr"
+    )
+
+    # Parse JSON
+    reading = None
+    json_match = re.search(r'\{[^}]+\}', ai_text)
+    if json_match:
+        data = json.loads(json_match.group())
+        reading = {
+            "systolic": int(data.get('systolic', 0)),
+            "diastolic": int(data.get('diastolic', 0)),
+            "pulse": int(data.get('pulse', 0)),
+        }
+        cache_put(key, {"ai_text": ai_text, "reading": reading})
+    return ai_text, reading
+
+
+# ✅ 多张照片批量识别 Batch OCR for many photos at once
+# 每张照片：Vision → 本地解析 → 必要时 AI；多张照片在有限的线程池里并发
+# Per photo: Vision, then the local parser, then the AI only if needed; photos run concurrently in a bounded pool
+OCR_WORKERS = 4
+
+
+# 照片的拍摄时间（EXIF），没有就返回 None When the photo was taken, from EXIF; None if missing
+def photo_time(image_bytes):
+    try:
+        exif = Image.open(io.BytesIO(image_bytes)).getexif()
+        value = exif.get_ifd(0x8769).get(0x9003) or exif.get(0x0132)
+        return datetime.datetime.strptime(value.strip(), "%Y:%m:%d %H:%M:%S") if value else None
+    except Exception:
+        return None
+
+
+def read_photo(get_vision_client, image_bytes, llm_client=None):
+    full_text, words, stats = detect_text(get_vision_client, image_bytes)
+    reading, confidence, method = parse_reading_locally(full_text, words)
+    if confidence < LOCAL_CONFIDENCE and full_text.strip() and llm_client is not None:
+        _, ai_reading = parse_reading_with_ai(full_text, llm_client)
+        if ai_reading and is_plausible(ai_reading):
+            reading, confidence, method = ai_reading, None, "ai"
+    return {
+        "text": full_text,
+        "reading": reading,
+        "confidence": confidence,
+        "method": method,
+        "taken": photo_time(image_bytes),
+        "stats": stats,
+    }
+
+
+# 按原顺序返回；单张失败只影响那一张 Results keep the input order; a failed photo only fails its own entry
+def read_photos(get_vision_client, images, llm_client=None, workers=OCR_WORKERS):
+    if not images:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(images)), thread_name_prefix="ocr") as pool:
+        futures = [pool.submit(read_photo, get_vision_client, image_bytes, llm_client) for image_bytes in images]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.exception("Batch OCR failed for one photo")
+                results.append({"error": str(e)})
+    return results
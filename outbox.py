@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from gspread.exceptions import APIError
+
+import perf
+from sheet_sync import CACHE_DIR, appended_start_row, forget_worksheet, worksheet_handle
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = os.path.join(CACHE_DIR, "outbox.sqlite3")
+
+# 每批最多写入的行数 Max rows per append_rows call
+MAX_BATCH_ROWS = 200
+# 连续写入之间的间隔：Sheets 每位用户每分钟约 60 次写入
+# Pause between back-to-back batches; Sheets allows about 60 write requests per minute per user
+WRITE_INTERVAL_SECONDS = 1.0
+# 连续写入时每几批才更新一次本地表（每次更新要重写整张表）
+# Back-to-back batches patch the local store once per this many batches, since each patch rewrites the table
+PATCH_EVERY_BATCHES = 10
+# 后台检查间隔（秒）Worker poll interval in seconds
+FLUSH_SECONDS = 5
+# 配额/服务器错误时指数退避 Exponential backoff on quota / server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+BASE_BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 300
+
+
+def _connect(path=OUTBOX_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            worksheet TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_worksheet_status ON outbox (worksheet, status, id)")
+    return conn
+
+
+# ✅ 提交入队（立即返回）Queue a row for the worksheet; returns immediately
+def enqueue(worksheet_title, row, path=OUTBOX_PATH):
+    now = time.time()
+    with _connect(path) as conn:
+        cur = conn.execute(
+            "INSERT INTO outbox (worksheet, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+            (worksheet_title, json.dumps(row, ensure_ascii=False), now, now),
+        )
+        return cur.lastrowid
+
+
+# 批量入队，一次事务 Queue many rows in one transaction (bulk import)
+def enqueue_many(worksheet_title, rows, path=OUTBOX_PATH):
+    now = time.time()
+    with _connect(path) as conn:
+        conn.executemany(
+            "INSERT INTO outbox (worksheet, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+            [(worksheet_title, json.dumps(row, ensure_ascii=False), now, now) for row in rows],
+        )
+    return len(rows)
+
+
+# 本地表还没有的行：排队中的，和已写入但还没更新到本地表的（'sent'）
+# Rows the local store doesn't have yet: queued ones, and written ones whose store patch is still coming ('sent')
+VISIBLE_STATUSES = "('pending', 'sent')"
+
+
+def pending_rows(worksheet_title, path=OUTBOX_PATH):
+    return [row for _, row in pending_since(worksheet_title, 0, path)]
+
+
+# [(id, 行)]，只取 id 大于 after_id 的 [(id, row)] for ids above after_id
+def pending_since(worksheet_title, after_id, path=OUTBOX_PATH):
+    with _connect(path) as conn:
+        cur = conn.execute(
+            f"SELECT id, payload FROM outbox WHERE worksheet = ? AND status IN {VISIBLE_STATUSES} AND id > ? ORDER BY id",
+            (worksheet_title, after_id),
+        )
+        return [(row_id, json.loads(payload)) for row_id, payload in cur]
+
+
+# 待写入行的版本 (行数, 最小 id, 最大 id)，不读内容 Version of the pending rows as (count, min id, max id), without reading them
+def pending_version(worksheet_title, path=OUTBOX_PATH):
+    with _connect(path) as conn:
+        return conn.execute(
+            f"SELECT COUNT(*), MIN(id), MAX(id) FROM outbox WHERE worksheet = ? AND status IN {VISIBLE_STATUSES}",
+            (worksheet_title,),
+        ).fetchone()
+
+
+# ✅ 被拒绝的行（不再自动重试），让用户选择重试或放弃
+# Rejected rows (no longer retried automatically), shown to the user to retry or discard
+def failed_rows(worksheet_title, path=OUTBOX_PATH):
+    with _connect(path) as conn:
+        cur = conn.execute(
+            "SELECT payload, last_error FROM outbox WHERE worksheet = ? AND status = 'failed' ORDER BY id",
+            (worksheet_title,),
+        )
+        return [(json.loads(payload), last_error) for payload, last_error in cur]
+
+
+def retry_failed(worksheet_title, path=OUTBOX_PATH):
+    with _connect(path) as conn:
+        cur = conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? "
+            "WHERE worksheet = ? AND status = 'failed'",
+            (time.time(), worksheet_title),
+        )
+        return cur.rowcount
+
+
+def discard_failed(worksheet_title, path=OUTBOX_PATH):
+    with _connect(path) as conn:
+        cur = conn.execute("DELETE FROM outbox WHERE worksheet = ? AND status = 'failed'", (worksheet_title,))
+        return cur.rowcount
+
+
+def _backoff(attempts):
+    delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempts)
+    return delay + random.uniform(0, delay / 2)
+
+
+def _is_retryable(error):
+    if isinstance(error, APIError):
+        return error.response.status_code in RETRYABLE_STATUS
+    # 网络错误等 Network errors and timeouts are retried too
+    return True
+
+
+# 写入一批，返回 (表, ids, 行, 起始行号)；没有可写的返回 None Write one batch; returns (worksheet, ids, rows, start row) or None
+def _flush_worksheet(conn, spreadsheet, title, now):
+    # 队首在退避中则整张表等待，保证顺序 Keep append order: wait while the head row is backing off
+    head = conn.execute(
+        "SELECT next_attempt_at FROM outbox WHERE worksheet = ? AND status = 'pending' ORDER BY id LIMIT 1",
+        (title,),
+    ).fetchone()
+    if head is None or head[0] > now:
+        return None
+
+    batch = conn.execute(
+        "SELECT id, payload, attempts FROM outbox WHERE worksheet = ? AND status = 'pending' ORDER BY id LIMIT ?",
+        (title, MAX_BATCH_ROWS),
+    ).fetchall()
+    ids = [row_id for row_id, _, _ in batch]
+    rows = [json.loads(payload) for _, payload, _ in batch]
+    placeholders = ",".join("?" * len(ids))
+
+    try:
+        worksheet = worksheet_handle(spreadsheet, title)
+        with perf.span("sheets.append"):
+            response = worksheet.append_rows(rows)
+    except Exception as e:
+        forget_worksheet(spreadsheet, title)
+        attempts = max(a for _, _, a in batch) + 1
+        if _is_retryable(e):
+            logger.warning("Outbox flush of %d rows to %s failed, retrying: %s", len(rows), title, e)
+            conn.execute(
+                f"UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id IN ({placeholders})",
+                (attempts, now + _backoff(attempts), str(e), *ids),
+            )
+        else:
+            # 数据本身有问题，保留记录但不再重试 Bad request: keep the rows but stop retrying
+            logger.error("Outbox flush of %d rows to %s rejected: %s", len(rows), title, e)
+            conn.execute(
+                f"UPDATE outbox SET attempts = ?, status = 'failed', last_error = ? WHERE id IN ({placeholders})",
+                (attempts, str(e), *ids),
+            )
+        conn.commit()
+        return None
+
+    # 更新本地表之后才删除，期间页面仍显示这些行 Deleted once the local store is patched; shown as pending until then
+    conn.execute(f"UPDATE outbox SET status = 'sent' WHERE id IN ({placeholders})", ids)
+    conn.commit()
+    return worksheet, ids, rows, appended_start_row(response)
+
+
+# 合并后的几批一起更新本地表，然后删除 Patch the local store once for merged batches, then delete them
+def _finish_group(conn, group, on_flushed):
+    if group is None:
+        return
+    try:
+        if on_flushed is not None:
+            on_flushed(group["worksheet"], group["rows"], group["start_row"])
+    finally:
+        placeholders = ",".join("?" * len(group["ids"]))
+        conn.execute(f"DELETE FROM outbox WHERE id IN ({placeholders})", group["ids"])
+        conn.commit()
+
+
+# 把一批加进这张表的合并组；不连续或已满时先更新本地表 Add a batch to its worksheet's group, finishing the group first when needed
+def _add_to_group(conn, groups, title, batch, on_flushed):
+    worksheet, ids, rows, start_row = batch
+    group = groups.get(title)
+    # 紧接着上一批写入的才合并 Only batches that landed right after the previous one are merged
+    contiguous = (
+        group is not None and group["start_row"] is not None and start_row is not None
+        and start_row == group["start_row"] + len(group["rows"])
+    )
+    if group is not None and (not contiguous or group["batches"] >= PATCH_EVERY_BATCHES):
+        del groups[title]
+        _finish_group(conn, group, on_flushed)
+        group = None
+    if group is None:
+        group = groups[title] = {"worksheet": worksheet, "ids": [], "rows": [], "start_row": start_row, "batches": 0}
+    group["ids"].extend(ids)
+    group["rows"].extend(rows)
+    group["batches"] += 1
+
+
+# ✅ 批量写入所有待发送的行 Flush pending rows, one append_rows call per worksheet batch
+# 各张表轮流写，每轮每张表一批，大批导入不会挡住别的病人的记录
+# Worksheets take turns, one batch each per pass, so a large import doesn't hold up other patients' rows
+# on_flushed(表, 行, 起始行号) 每合并一组调用一次 on_flushed(worksheet, rows, start_row) runs once per merged group
+def flush(spreadsheet, on_flushed=None, path=OUTBOX_PATH):
+    flushed = 0
+    groups = {}
+    conn = _connect(path)
+    try:
+        wrote = False
+        more = True
+        while more:
+            more = False
+            # 每轮重新查，新加入的表（例如刚提交的表单）下一轮就轮到 Re-read each pass so newly queued worksheets join the rotation
+            titles = [
+                t for (t,) in
+                conn.execute("SELECT DISTINCT worksheet FROM outbox WHERE status = 'pending' ORDER BY worksheet")
+            ]
+            for title in titles:
+                if wrote:
+                    time.sleep(WRITE_INTERVAL_SECONDS)
+                batch = _flush_worksheet(conn, spreadsheet, title, time.time())
+                wrote = batch is not None
+                if batch is None:
+                    continue
+                flushed += len(batch[2])
+                _add_to_group(conn, groups, title, batch, on_flushed)
+                if len(batch[2]) == MAX_BATCH_ROWS:
+                    more = True
+                else:
+                    # 这张表写完了，马上更新本地表 This worksheet is done; patch the local store now
+                    _finish_group(conn, groups.pop(title), on_flushed)
+    finally:
+        try:
+            for group in groups.values():
+                try:
+                    _finish_group(conn, group, on_flushed)
+                except Exception:
+                    logger.exception("Patching the local store after a flush failed")
+        finally:
+            conn.close()
+    return flushed
+
+
+def _flush_loop(spreadsheet, wake_event, on_flushed, interval, path):
+    while True:
+        wake_event.wait(interval)
+        wake_event.clear()
+        try:
+            flush(spreadsheet, on_flushed=on_flushed, path=path)
+        except Exception:
+            logger.exception("Outbox flush failed")
+
+
+# ✅ 后台写入线程；返回的 Event 用于立即唤醒 Background flush worker; set() the returned event to flush now
+def start_flush_worker(spreadsheet, on_flushed=None, interval=FLUSH_SECONDS, path=OUTBOX_PATH):
+    # 上次退出前已写入的行，交给增量同步 Rows written before the last exit are left to the delta sync
+    with _connect(path) as conn:
+        conn.execute("DELETE FROM outbox WHERE status = 'sent'")
+    wake_event = threading.Event()
+    thread = threading.Thread(
+        target=_flush_loop,
+        args=(spreadsheet, wake_event, on_flushed, interval, path),
+        name="outbox-flush",
+        daemon=True,
+    )
+    thread.start()
+    return wake_event
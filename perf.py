@@ -0,0 +1,173 @@
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from sheet_sync import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# ✅ 性能记录：每次脚本运行的耗时、缓存命中，写成 JSON lines
+# Per-run instrumentation: timing spans and cache hit/miss counters, one JSON line per script run
+PERF_LOG_PATH = os.environ.get("HEALTH_TRACKER_PERF_LOG", os.path.join(CACHE_DIR, "perf.jsonl"))
+PERF_LOG_MAX_BYTES = 5 * 1024 * 1024
+RECENT_RUNS = 50
+
+# 当前线程的这次运行（Streamlit 每个会话一个脚本线程）The current script run; Streamlit runs each session on its own thread
+_local = threading.local()
+# 整个进程的累计，包括后台线程 Process-wide totals, background threads included
+_totals = collections.defaultdict(lambda: {"count": 0, "ms": 0.0, "max_ms": 0.0})
+_recent_runs = collections.deque(maxlen=RECENT_RUNS)
+_lock = threading.Lock()
+
+
+def _new_run(**tags):
+    return {
+        "tags": tags,
+        "started": time.time(),
+        "start": time.perf_counter(),
+        "spans": {},
+        "cache": {},
+    }
+
+
+# Streamlit 每次运行换一个线程，被 st.stop()/st.rerun() 打断的运行由调用方（会话状态）传回 finish_run(run=...)
+# Streamlit starts each run on a new thread, so runs cut short by st.stop()/st.rerun() are passed back by the caller
+def start_run(**tags):
+    _local.run = _new_run(**tags)
+    return _local.run
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def tag(**tags):
+    run = current_run()
+    if run is not None:
+        run["tags"].update(tags)
+
+
+def _record(name, elapsed_ms):
+    run = current_run()
+    if run is not None:
+        span = run["spans"].setdefault(name, {"count": 0, "ms": 0.0})
+        span["count"] += 1
+        span["ms"] += elapsed_ms
+        run["last"] = time.perf_counter()
+    with _lock:
+        total = _totals[name]
+        total["count"] += 1
+        total["ms"] += elapsed_ms
+        total["max_ms"] = max(total["max_ms"], elapsed_ms)
+
+
+# 计时区块（可嵌套，外层包含内层时间）Timing span; spans may nest, outer spans include inner time
+@contextlib.contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _cache_counter(name):
+    run = current_run()
+    if run is None:
+        return None
+    return run["cache"].setdefault(name, {"calls": 0, "misses": 0})
+
+
+# ✅ 缓存命中统计 Cache hit/miss counters for st.cache_data / st.cache_resource loaders
+# 外层 track_cache 计调用次数，函数体里的 cache_miss() 计未命中
+# track_cache (outside the Streamlit decorator) counts calls; cache_miss() inside the body counts misses
+def track_cache(name):
+    def decorator(cached_func):
+        @functools.wraps(cached_func)
+        def wrapper(*args, **kwargs):
+            counter = _cache_counter(name)
+            if counter is not None:
+                counter["calls"] += 1
+            with span(f"cache.{name}"):
+                return cached_func(*args, **kwargs)
+        # 保留 .clear() Keep the Streamlit cache's clear()
+        if hasattr(cached_func, "clear"):
+            wrapper.clear = cached_func.clear
+        return wrapper
+    return decorator
+
+
+def cache_miss(name):
+    counter = _cache_counter(name)
+    if counter is not None:
+        counter["misses"] += 1
+
+
+def _write_line(line, path=PERF_LOG_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        if os.path.getsize(path) > PERF_LOG_MAX_BYTES:
+            os.replace(path, f"{path}.1")
+    except OSError:
+        pass
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+# ✅ 结束这次运行：汇总、写日志 Finish the run: summarize, append a JSON line, keep it for the admin panel
+# run 不传时结束当前线程的运行；已结束的不再记 Defaults to this thread's run; a run is only logged once
+def finish_run(path=PERF_LOG_PATH, run=None, stopped=False):
+    if run is None:
+        run = current_run()
+    if run is None or run.get("finished"):
+        return None
+    run["finished"] = True
+    if current_run() is run:
+        _local.run = None
+    # 被打断的运行算到最后一个计时区块结束 A stopped run ends at its last recorded span, not at the next run
+    end = run.get("last", run["start"]) if stopped else time.perf_counter()
+    if stopped:
+        run["tags"]["stopped"] = True
+    summary = {
+        "ts": run["started"],
+        **run["tags"],
+        "total_ms": round((end - run["start"]) * 1000, 1),
+        "spans": {name: {"count": s["count"], "ms": round(s["ms"], 1)} for name, s in run["spans"].items()},
+        "cache": {
+            name: {"hits": c["calls"] - c["misses"], "misses": c["misses"]} for name, c in run["cache"].items()
+        },
+    }
+    line = json.dumps(summary, ensure_ascii=False)
+    try:
+        _write_line(line, path)
+    except OSError:
+        logger.exception("Could not write perf log")
+    logger.info("perf %s", line)
+    with _lock:
+        _recent_runs.append(summary)
+    return summary
+
+
+def recent_runs():
+    with _lock:
+        return list(_recent_runs)
+
+
+def totals():
+    with _lock:
+        return {name: dict(values) for name, values in _totals.items()}
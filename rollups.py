@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+METRICS = ["Systolic", "Diastolic", "Pulse", "Glucose(mmol/L)"]
+
+# 汇总粒度 Rollup granularities → pandas period frequency
+FREQUENCIES = {"daily": "D", "weekly": "W", "monthly": "M"}
+
+# 每张图最多显示的点数 Max points drawn per chart
+MAX_CHART_POINTS = 500
+
+
+def _partial_aggregates(df, freq):
+    metrics = [m for m in METRICS if m in df.columns]
+    periods = df.index.to_period(freq)
+    grouped = df[metrics].groupby(periods)
+    return {
+        "sum": grouped.sum(min_count=1),
+        "count": grouped.count(),
+        "min": grouped.min(),
+        "max": grouped.max(),
+    }
+
+
+def _merge_aggregates(old, new):
+    return {
+        "sum": old["sum"].add(new["sum"], fill_value=0),
+        "count": old["count"].add(new["count"], fill_value=0),
+        "min": pd.concat([old["min"], new["min"]]).groupby(level=0).min(),
+        "max": pd.concat([old["max"], new["max"]]).groupby(level=0).max(),
+    }
+
+
+# 参与计算的列和时间索引的指纹；按行求和，可以分段累加
+# Fingerprint of the index and the columns a state depends on; a sum of row hashes, so it adds up piece by piece
+def fingerprint(df, columns):
+    columns = [c for c in columns if c in df.columns]
+    return int(pd.util.hash_pandas_object(df[columns], index=True).sum())
+
+
+# 新数据只是在末尾追加时返回已处理的行数；没有新行返回 None；需要重新计算返回 0
+# 已处理的行按指纹比较，表中间被修改（例如在 Google Sheets 里改了旧记录）也会重新计算
+# Rows already processed when the table only grew at the end; None when nothing is new; 0 to rebuild.
+# The processed rows are compared by fingerprint, so edits to earlier rows (e.g. in Google Sheets) rebuild too
+def processed_rows(state, df, columns):
+    if state is None:
+        return 0
+    # 和上次是同一版本的数据 The same data version as last time
+    version = df.attrs.get("data_version")
+    if version is not None and version == state["version"]:
+        return None
+    n = state["rows"]
+    if n > len(df) or fingerprint(df.iloc[:n], columns) != state["fingerprint"]:
+        return 0
+    if n < len(df):
+        return n
+    # 内容没变，记下新版本，下次不用再算指纹 Unchanged; remember the version so the next call skips the fingerprint
+    state["version"] = version
+    return None
+
+
+# 处理到最后一行之后的状态标记 Bookkeeping stored with a state once every row is processed
+def processed_marker(state, df, start, columns):
+    base = state["fingerprint"] if start else 0
+    return {
+        "rows": len(df),
+        "version": df.attrs.get("data_version"),
+        # 超过 64 位的部分丢掉，和 pandas 求和一样回绕 Wraps around at 64 bits like the pandas sum
+        "fingerprint": (base + fingerprint(df.iloc[start:], columns)) % (1 << 64),
+    }
+
+
+# ✅ 增量汇总 Incremental rollups
+# 新数据只是在末尾追加时只处理新行，否则重新计算
+# Only the appended rows are aggregated when the table grew at the end; anything else rebuilds
+def update_rollups(state, df):
+    if not isinstance(df.index, pd.DatetimeIndex):
+        return None
+
+    start = processed_rows(state, df, METRICS)
+    if start is None:
+        return state
+
+    new_rows = df.iloc[start:]
+    aggregates = {}
+    for name, freq in FREQUENCIES.items():
+        partial = _partial_aggregates(new_rows, freq)
+        aggregates[name] = _merge_aggregates(state["aggregates"][name], partial) if start else partial
+
+    return {
+        **processed_marker(state, df, start, METRICS),
+        "aggregates": aggregates,
+    }
+
+
+# 某个粒度的 最小/平均/最大 值 Min/mean/max per metric at one granularity
+def rollup_view(state, granularity):
+    agg = state["aggregates"][granularity]
+    counts = agg["count"].replace(0, np.nan)
+    view = pd.concat(
+        {"min": agg["min"], "mean": agg["sum"] / counts, "max": agg["max"]},
+        axis=1,
+    ).swaplevel(axis=1).sort_index(axis=1)
+    view.index = view.index.to_timestamp()
+    return view.sort_index()
+
+
+# 全部记录的平均值 Overall means straight from the rollups
+def overall_means(state):
+    agg = state["aggregates"]["monthly"]
+    counts = agg["count"].sum()
+    return (agg["sum"].sum() / counts.replace(0, np.nan)).fillna(0)
+
+
+# ✅ LTTB 降采样 Largest-Triangle-Three-Buckets downsampling; returns the kept positions
+def lttb_indices(x, y, threshold):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    kept = np.empty(threshold, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean() if next_hi > next_lo else x[-1]
+        avg_y = y[next_lo:next_hi].mean() if next_hi > next_lo else y[-1]
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+# 多条曲线共用时间轴：取各曲线保留点的并集 Several series on one axis keep the union of their LTTB points
+def downsample(chart_df, max_points=MAX_CHART_POINTS):
+    if len(chart_df) <= max_points:
+        return chart_df
+    x = chart_df.index.values.astype("datetime64[ns]").astype("int64")
+    per_series = max(3, max_points // max(1, len(chart_df.columns)))
+    kept = set()
+    for col in chart_df.columns:
+        y = chart_df[col].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(y))
+        kept.update(valid[lttb_indices(x[valid], y[valid], per_series)])
+    return chart_df.iloc[sorted(kept)]
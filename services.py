@@ -0,0 +1,65 @@
+import importlib
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ✅ 外部服务延迟初始化 Lazy registry for external clients
+# 第一次 get() 时才导入/创建，并记录耗时 Imported/created on first get(), with timings recorded
+_factories = {}
+_instances = {}
+_timings = {}
+_lock = threading.RLock()
+# 每个服务一把锁，慢的初始化不挡住别的服务 One lock per service, so a slow factory doesn't block the others
+_name_locks = {}
+
+
+def register(name, factory):
+    with _lock:
+        _factories.setdefault(name, factory)
+
+
+def _record(name, key, started):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _timings.setdefault(name, {})[key] = elapsed_ms
+    logger.info("%s %s: %.0f ms", name, key.replace("_ms", ""), elapsed_ms)
+
+
+# 导入模块并记录耗时（已导入的不算）Import a module and record how long it took (no-op if already loaded)
+def timed_import(module_name):
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    with _lock:
+        _record(module_name, "import_ms", started)
+    return module
+
+
+def _lock_for(name):
+    with _lock:
+        return _name_locks.setdefault(name, threading.Lock())
+
+
+# 已创建的直接返回，不用加锁 Existing instances are returned without taking a lock
+def get(name):
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock_for(name):
+        if name in _instances:
+            return _instances[name]
+        started = time.perf_counter()
+        # 创建失败不缓存，下次重试 Failures aren't cached, so the next call retries
+        instance = _factories[name]()
+        with _lock:
+            _record(name, "init_ms", started)
+        _instances[name] = instance
+        return instance
+
+
+def timings():
+    with _lock:
+        return {name: dict(values) for name, values in _timings.items()}
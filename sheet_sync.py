@@ -0,0 +1,309 @@
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+# 本地同步缓存目录 Local sync cache directory
+CACHE_DIR = os.environ.get(
+    "HEALTH_TRACKER_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+
+# 定期全量同步，捕捉中间行的修改 Periodic full resync catches edits in the middle of the sheet
+FULL_RESYNC_SECONDS = 30 * 60
+
+# 每次增量读取的最大行数 Max rows fetched per bounded delta read
+DELTA_BATCH_ROWS = 500
+
+# 进程内状态，避免每次都读盘 In-process state so each sync doesn't re-read the pickle
+_states = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+# 工作表句柄和行号索引 Worksheet handles and row-number indexes
+_handles = {}
+_row_indexes = {}
+
+
+def _state_path(worksheet):
+    return os.path.join(CACHE_DIR, f"sync_{worksheet.spreadsheet.id}_{worksheet.id}.pkl")
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def _load_state(path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+# ✅ 缓存工作表句柄，避免每次 rerun 都读取表格元数据
+# Cached worksheet handles: spreadsheet.worksheet() fetches metadata from the API on every call
+def worksheet_handle(spreadsheet, title):
+    key = (spreadsheet.id, title)
+    with _locks_guard:
+        handle = _handles.get(key)
+    if handle is None:
+        handle = spreadsheet.worksheet(title)
+        with _locks_guard:
+            handle = _handles.setdefault(key, handle)
+    return handle
+
+
+# 写入失败时丢弃句柄（工作表可能被删除或重建）Drop a handle after a failed write; the sheet may have been recreated
+def forget_worksheet(spreadsheet, title):
+    with _locks_guard:
+        _handles.pop((spreadsheet.id, title), None)
+
+
+def _bump_revision(state, previous=None):
+    state["revision"] = (previous or state).get("revision", 0) + 1
+
+
+def _pad(row, width):
+    row = [str(v) for v in row[:width]]
+    return row + [""] * (width - len(row))
+
+
+def _cells_equal(a, b):
+    # 写入 5.0 后表格显示 "5" Numbers written as 5.0 read back formatted as "5"
+    if a == b:
+        return True
+    try:
+        return float(a) == float(b)
+    except ValueError:
+        return False
+
+
+def _rows_equal(a, b):
+    return len(a) == len(b) and all(map(_cells_equal, a, b))
+
+
+def _row_range(start_row, end_row, width):
+    return f"{rowcol_to_a1(start_row, 1)}:{rowcol_to_a1(end_row, width)}"
+
+
+def _full_sync(worksheet, now):
+    values = worksheet.get_all_values()
+    header = [str(h) for h in values[0]] if values else []
+    rows = [_pad(r, len(header)) for r in values[1:]]
+    return {
+        "header": header,
+        "frame": pd.DataFrame(rows, columns=header),
+        "last_row": rows[-1] if rows else header,
+        "last_full_sync": now,
+    }
+
+
+def _delta_sync(worksheet, state):
+    header = state["header"]
+    width = len(header)
+    if width == 0:
+        return None
+
+    # 已同步的数据行数（第 1 行是表头）Synced data rows; sheet row 1 is the header
+    row_count = len(state["frame"])
+    last_row_num = row_count + 1
+
+    # 一次请求：表头 + 上次最后一行 + 新增行 One call: header, last seen row and the new rows
+    first_new = last_row_num + 1
+    ranges = [
+        _row_range(1, 1, width),
+        _row_range(last_row_num, last_row_num, width),
+        _row_range(first_new, first_new + DELTA_BATCH_ROWS - 1, width),
+    ]
+    header_vals, last_vals, new_vals = worksheet.batch_get(ranges)
+
+    if _pad(header_vals[0] if header_vals else [], width) != header:
+        return None
+    if not _rows_equal(_pad(last_vals[0] if last_vals else [], width), state["last_row"]):
+        # 旧行被修改或删除 Existing rows were edited or deleted
+        return None
+
+    new_rows = [_pad(r, width) for r in new_vals]
+    while len(new_vals) == DELTA_BATCH_ROWS:
+        first_new += DELTA_BATCH_ROWS
+        new_vals = worksheet.get(_row_range(first_new, first_new + DELTA_BATCH_ROWS - 1, width))
+        new_rows.extend(_pad(r, width) for r in new_vals)
+
+    if new_rows:
+        appended = pd.DataFrame(new_rows, columns=header)
+        state["frame"] = pd.concat([state["frame"], appended], ignore_index=True)
+        state["last_row"] = new_rows[-1]
+    return state
+
+
+# ✅ 增量同步工作表 Incremental worksheet sync
+# 只读取上次同步之后追加的行；检测到修改或删除时才全量重新同步
+# Only fetches rows appended since the last sync; falls back to a full resync on edits/deletions
+# 返回 (原始数据, 是否有变化)；没有变化时不复制，原始数据为 None
+# Returns (raw frame, changed); the frame is only copied when it changed, otherwise it is None
+def sync_worksheet(worksheet, force_full=False):
+    path = _state_path(worksheet)
+    with _lock_for(path):
+        now = time.time()
+        previous = _states.get(path) or _load_state(path)
+        state = previous
+        if state is None or force_full or now - state["last_full_sync"] > FULL_RESYNC_SECONDS:
+            state = _full_sync(worksheet, now)
+            changed = True
+        else:
+            row_count = len(state["frame"])
+            synced = _delta_sync(worksheet, state)
+            if synced is None:
+                state = _full_sync(worksheet, now)
+                changed = True
+            else:
+                changed = len(state["frame"]) != row_count
+        if changed:
+            _bump_revision(state, previous)
+            _save_state(path, state)
+        _states[path] = state
+        return (state["frame"].copy() if changed else None), changed
+
+
+def _cached_state(path):
+    state = _states.get(path) or _load_state(path)
+    if state is not None:
+        _states[path] = state
+    return state
+
+
+# append_rows 返回的起始行号 First sheet row written by an append_rows/append_row call
+def appended_start_row(response):
+    updated_range = (response or {}).get("updates", {}).get("updatedRange", "")
+    if not updated_range:
+        return None
+    first_cell = updated_range.split("!")[-1].split(":")[0]
+    return a1_to_rowcol(first_cell)[0]
+
+
+# ✅ 本地补丁：写入后直接更新同步状态，无需重新读取
+# Local patches: apply our own writes to the sync state without reading the sheet back
+
+# 追加的行紧接在已同步数据之后才会应用，返回新增的原始行，否则返回 None
+# Applied only when the rows land right after the synced data; returns the appended raw rows or None
+def apply_append(worksheet, rows, start_row):
+    path = _state_path(worksheet)
+    with _lock_for(path):
+        state = _cached_state(path)
+        if state is None or not state["header"] or start_row != len(state["frame"]) + 2:
+            # 不连续（别人也写入了），交给下次增量同步 Not contiguous; the next delta sync picks it up
+            return None
+        new_rows = [_pad(r, len(state["header"])) for r in rows]
+        appended = pd.DataFrame(new_rows, columns=state["header"])
+        state["frame"] = pd.concat([state["frame"], appended], ignore_index=True)
+        state["last_row"] = new_rows[-1]
+        _bump_revision(state)
+        _save_state(path, state)
+        return appended
+
+
+# 单元格更新 [(行, 列, 值)]，返回更新后的原始数据，否则返回 None
+# Cell updates [(row, col, value)]; returns the patched raw frame, or None if any cell is out of range
+def apply_cell_updates(worksheet, updates):
+    path = _state_path(worksheet)
+    with _lock_for(path):
+        state = _cached_state(path)
+        if state is None:
+            return None
+        row_count, width = len(state["frame"]), len(state["header"])
+        if not all(0 <= row - 2 < row_count and 1 <= col <= width for row, col, _ in updates):
+            return None
+        for row, col, value in updates:
+            state["frame"].iat[row - 2, col - 1] = str(value)
+        if any(row - 2 == row_count - 1 for row, _, _ in updates):
+            state["last_row"] = [str(v) for v in state["frame"].iloc[row_count - 1]]
+        _bump_revision(state)
+        _save_state(path, state)
+        return state["frame"].copy()
+
+
+# 已同步的原始数据和版本号 The synced raw frame and its revision; (None, None) before the first sync
+def synced_frame(worksheet):
+    path = _state_path(worksheet)
+    with _lock_for(path):
+        state = _cached_state(path)
+        if state is None:
+            return None, None
+        return state["frame"].copy(), state.get("revision", 0)
+
+
+# ✅ 冲突检测：一次请求读取这些行，返回和本地副本不一样的行号
+# Conflict check: reads the given sheet rows in one call and returns those that differ from the synced copy
+# frame：和这份原始数据（例如用户看到的快照）比较，而不是当前同步的副本
+# frame: compare with this raw frame (e.g. the snapshot the user was shown) instead of the synced copy
+def stale_rows(worksheet, row_nums, frame=None):
+    if frame is None:
+        path = _state_path(worksheet)
+        with _lock_for(path):
+            state = _cached_state(path)
+            if state is None:
+                return sorted(row_nums)
+            frame = state["frame"]
+    header = [str(h) for h in frame.columns]
+    width = len(header)
+    row_nums = sorted(row_nums)
+    if not row_nums:
+        return []
+    ranges = [_row_range(1, 1, width)] + [_row_range(r, r, width) for r in row_nums]
+    header_vals, *row_vals = worksheet.batch_get(ranges)
+    if _pad(header_vals[0] if header_vals else [], width) != header:
+        # 表头变了，所有行都算冲突 A changed header invalidates every row
+        return row_nums
+    stale = []
+    for row_num, values in zip(row_nums, row_vals):
+        index = row_num - 2
+        local = [str(v) for v in frame.iloc[index]] if 0 <= index < len(frame) else None
+        if local is None or not _rows_equal(_pad(values[0] if values else [], width), local):
+            stale.append(row_num)
+    return stale
+
+
+# ✅ 本地行号索引：值 → 表格行号，表格有变化时才重建
+# Local row index: cell value -> sheet row number, rebuilt only when the synced sheet changes
+# 重复的值取第一行（和 find() 一样）Duplicates map to the first row, like find(); None before the first sync
+def row_index(worksheet, column):
+    path = _state_path(worksheet)
+    with _lock_for(path):
+        state = _cached_state(path)
+        if state is None or column not in state["header"]:
+            return None
+        revision = state.get("revision", 0)
+        cached = _row_indexes.get((path, column))
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        index = {}
+        # 第 1 行是表头 Sheet row 1 is the header
+        for row_num, value in enumerate(state["frame"][column], start=2):
+            value = value.strip()
+            if value:
+                index.setdefault(value, row_num)
+        _row_indexes[(path, column)] = (revision, index)
+        return index
+
+
+# 表头中的列号（从 1 开始）1-based column number from the synced header
+def column_number(worksheet, column):
+    path = _state_path(worksheet)
+    with _lock_for(path):
+        state = _cached_state(path)
+        if state is None or column not in state["header"]:
+            return None
+        return state["header"].index(column) + 1
@@ -0,0 +1,124 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from health_data import STOCK_NUMERIC_COLUMNS, normalize_stock_records
+
+# 提前几天提醒 Days before run-out that trigger the low-stock warning
+WARNING_DAYS = 7
+WARNING_TEXT = "⚠️ 快用完了！Going to finish!"
+FINISHED_TEXT = "❌ 已用完 Ran out!"
+
+
+def _took_medication(health_df):
+    return health_df["Took Medication"].astype(str).str.startswith("是")
+
+
+# 每种药自补药以来有服药记录的天数 Distinct days with a logged dose since each refill
+def logged_dose_days(stock_df, health_df):
+    if health_df is None or health_df.empty or not {"Took Medication", "Medication", "Date"} <= set(health_df.columns):
+        return pd.Series(0, index=stock_df.index)
+
+    logs = health_df.loc[_took_medication(health_df), ["Medication", "Date"]].copy()
+    logs["Date"] = pd.to_datetime(logs["Date"], errors="coerce").dt.normalize()
+    logs = logs.dropna().drop_duplicates()
+
+    refills = stock_df[["jie", "Refill Date"]].rename_axis("stock_row").reset_index()
+    matched = refills.merge(logs, left_on="jie", right_on="Medication")
+    matched = matched[matched["Date"] >= matched["Refill Date"]]
+    return matched.groupby("stock_row").size().reindex(stock_df.index, fill_value=0)
+
+
+# ✅ 药物库存预测（向量化）Vectorized stock projection
+# 有服药记录时按实际服药天数计算用量，否则按每日剂量从补药日起算
+# Uses logged dose days when a medication has them, otherwise assumes the nominal daily dose since refill
+def project_stock(stock_df, health_df=None, today=None):
+    df = stock_df.copy()
+    today = pd.Timestamp(today if today is not None else pd.Timestamp.today()).normalize()
+
+    # 剂量为 0 或空白时不做预测 Zero or blank doses never run out
+    dose = df["Dose Per Day"].where(df["Dose Per Day"] > 0)
+    elapsed_days = (today - df["Refill Date"]).dt.days.clip(lower=0)
+    logged_days = logged_dose_days(df, health_df)
+    taken_days = logged_days.where(logged_days > 0, elapsed_days)
+
+    stock_left = df["Total Given"] - taken_days * dose
+    days_left = np.floor(stock_left / dose)
+
+    df["Logged Days"] = logged_days
+    df["Remaining Stock"] = stock_left.clip(lower=0)
+    df["Remaining Days"] = days_left.clip(lower=0)
+    df["Estimated Finish Date"] = today + pd.to_timedelta(days_left, unit="D")
+    df["Warning"] = np.select(
+        [days_left < 0, days_left <= WARNING_DAYS],
+        [FINISHED_TEXT, WARNING_TEXT],
+        default="",
+    )
+
+    return df
+
+
+# ✅ 批量编辑：在本地比较表格修改，一次写回
+# Batch editing: edits are diffed locally against the synced sheet and written back in one call
+NAME_COLUMN = "jie"
+ROW_COLUMN = "Row"
+
+
+# 编辑用的表格，Row 是表格中的行号 Editor frame; Row holds each medication's sheet row number
+def stock_editor_frame(raw_df):
+    raw_df = raw_df.loc[:, (raw_df.columns != "") & ~raw_df.columns.duplicated()]
+    raw_df = raw_df[(raw_df != "").any(axis=1)]
+    # 第 1 行是表头 Sheet row 1 is the header
+    rows = raw_df.index + 2
+    df = normalize_stock_records(raw_df)
+    # 允许输入小数剂量 Float columns so the editor accepts fractional doses
+    for col in STOCK_NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(float)
+    df.insert(0, ROW_COLUMN, rows)
+    return df
+
+
+# 写回表格的值 Cell value as written to the sheet
+def _sheet_value(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# 返回 {"updates": [(行, 列, 值)], "appends": [行], "deleted": [行号], "invalid": [新行序号]}
+# Returns changed cells, new rows, removed sheet rows (not supported) and new rows missing a name
+def diff_stock_edits(base_df, edited_df, header):
+    columns = [c for c in base_df.columns if c != ROW_COLUMN and c in header]
+    base = base_df.set_index(ROW_COLUMN)
+    is_new = edited_df[ROW_COLUMN].isna()
+
+    updates = []
+    existing = edited_df[~is_new].astype({ROW_COLUMN: int}).set_index(ROW_COLUMN)
+    for row_num, row in existing.iterrows():
+        if row_num not in base.index:
+            continue
+        for col in columns:
+            value = _sheet_value(row[col])
+            if str(value) != str(_sheet_value(base.at[row_num, col])):
+                updates.append((row_num, header.index(col) + 1, value))
+
+    appends, invalid = [], []
+    for position, (_, row) in enumerate(edited_df[is_new].iterrows()):
+        values = {col: _sheet_value(row.get(col)) for col in columns}
+        if all(v == "" for v in values.values()):
+            continue
+        if str(values.get(NAME_COLUMN, "")).strip() == "":
+            invalid.append(position + 1)
+            continue
+        appends.append([values.get(col, "") for col in header])
+
+    deleted = sorted(set(base.index) - set(existing.index))
+    return {"updates": updates, "appends": appends, "deleted": deleted, "invalid": invalid}
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+
+from alerts import APP_DIR, MAX_MESSAGE_CHARS, STOCK_REPEAT_SECONDS, FakeTransport, RateLimiter, send_alerts
+
+NOW = 1_700_000_000.0
+
+
+def no_wait():
+    return RateLimiter(per_second=1, clock=lambda: 0.0, sleep=lambda seconds: None)
+
+
+def reading(i):
+    return {"key": f"bp|mum|{i}", "text": f"🩺 reading {i} " + "x" * 100, "repeat": None}
+
+
+def low_stock(name):
+    return {"key": f"stock|mum|{name}", "text": f"💊 {name} low", "repeat": STOCK_REPEAT_SECONDS}
+
+
+def send(alert_list, path, now=NOW, recipients=("+1",), **kwargs):
+    transport = FakeTransport()
+    sent = send_alerts(alert_list, transport, list(recipients), str(path), limiter=no_wait(), now=now, **kwargs)
+    return sent, transport
+
+
+def test_importing_alerts_leaves_the_cache_dir_alone():
+    script = "import os, sys, alerts; print('sheet_sync' in sys.modules, os.environ.get('HEALTH_TRACKER_CACHE_DIR'))"
+    env = {k: v for k, v in os.environ.items() if k != "HEALTH_TRACKER_CACHE_DIR"}
+    result = subprocess.run([sys.executable, "-c", script], env=env, cwd=APP_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "None"]
+
+
+def test_each_alert_goes_to_each_recipient_once(tmp_path):
+    path = tmp_path / "alerts.sqlite3"
+    sent, transport = send([reading(1), low_stock("Med-01")], path, recipients=("+1", "+2"))
+    assert sent == 2
+    assert [to for to, _ in transport.sent] == ["+1", "+2"]
+
+    sent, transport = send([reading(1), low_stock("Med-01")], path, now=NOW + 60, recipients=("+1", "+2"))
+    assert sent == 0 and transport.sent == []
+
+
+def test_low_stock_repeats_after_a_day_but_readings_do_not(tmp_path):
+    path = tmp_path / "alerts.sqlite3"
+    send([reading(1), low_stock("Med-01")], path)
+
+    sent, transport = send([reading(1), low_stock("Med-01")], path, now=NOW + STOCK_REPEAT_SECONDS)
+    assert sent == 1
+    body = transport.sent[0][1]
+    assert "Med-01" in body and "reading 1" not in body
+
+
+def test_alerts_are_packed_into_few_messages(tmp_path):
+    many = [reading(i) for i in range(40)]
+    sent, transport = send(many, tmp_path / "alerts.sqlite3")
+
+    bodies = [body for _, body in transport.sent]
+    assert sent == len(bodies) == 4
+    assert all(len(body) <= MAX_MESSAGE_CHARS for body in bodies)
+    assert all(f"reading {i} " in "\n".join(bodies) for i in range(40))
+
+
+def test_dry_run_records_nothing(tmp_path):
+    path = tmp_path / "alerts.sqlite3"
+    sent, _ = send([reading(1)], path, dry_run=True)
+    assert sent == 1
+
+    sent, _ = send([reading(1)], path)
+    assert sent == 1
+
+
+def test_failed_send_is_retried_next_run(tmp_path):
+    path = tmp_path / "alerts.sqlite3"
+
+    class Failing(FakeTransport):
+        def send(self, to, body):
+            raise RuntimeError("network down")
+
+    assert send_alerts([reading(1)], Failing(), ["+1"], str(path), limiter=no_wait(), now=NOW) == 0
+    sent, _ = send([reading(1)], path)
+    assert sent == 1
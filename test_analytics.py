@@ -0,0 +1,50 @@
+import pandas as pd
+
+from analytics import meal_glucose, time_of_day_means, update_analytics
+
+
+def readings(systolic, meals=None):
+    index = pd.date_range("2024-03-01 08:00", periods=len(systolic), freq="D")
+    return pd.DataFrame({
+        "Time Period": ["08:00:00"] * len(systolic),
+        "Before/After": meals or ["饭前"] * len(systolic),
+        "Systolic": systolic,
+        "Diastolic": [80] * len(systolic),
+        "Pulse": [70] * len(systolic),
+        "Glucose(mmol/L)": [5.5] * len(systolic),
+    }, index=index)
+
+
+def test_edit_in_the_middle_rebuilds():
+    df = readings([120] * 5)
+    state = update_analytics(None, df)
+
+    edited = df.copy()
+    edited.iloc[2, edited.columns.get_loc("Systolic")] = 200
+    rebuilt = update_analytics(state, edited)
+
+    assert rebuilt is not state
+    assert time_of_day_means(rebuilt).loc["早上 Morning", "Systolic"] == 136.0
+    assert rebuilt["rolling"]["Systolic 7d"].iloc[-1] == 136.0
+
+
+def test_meal_label_edit_rebuilds():
+    df = readings([120] * 4)
+    state = update_analytics(None, df)
+
+    edited = readings([120] * 4, meals=["饭前", "饭后", "饭前", "饭前"])
+    state = update_analytics(state, edited)
+
+    assert meal_glucose(state)["count"].to_dict() == {"饭前 Before": 3, "饭后 After": 1}
+
+
+def test_append_matches_full_rebuild():
+    df = readings([120] * 5)
+    state = update_analytics(None, df)
+
+    grown = readings([120] * 5 + [150])
+    state = update_analytics(state, grown)
+    rebuilt = update_analytics(None, grown)
+
+    assert state["fingerprint"] == rebuilt["fingerprint"]
+    pd.testing.assert_frame_equal(state["rolling"], rebuilt["rolling"])
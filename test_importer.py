@@ -0,0 +1,30 @@
+import io
+
+import pandas as pd
+
+from health_data import HEALTH_SHEET_COLUMNS, normalize_health_records
+from importer import existing_keys, import_health_file
+
+CSV = "Date,Time,Systolic,Diastolic\n2024-03-01 07:30,,130,85\n2024-03-02,,120,80\n2024-03-03,08:15,121,81\n"
+
+
+def run_import(known_keys=()):
+    written = []
+    progress = list(import_health_file(io.BytesIO(CSV.encode()), "export.csv", known_keys, written.extend))
+    return written, progress
+
+
+def test_time_inside_the_date_column_is_kept():
+    written, _ = run_import()
+    assert [(row[0], row[1]) for row in written] == [
+        ("2024-03-01", "07:30:00"), ("2024-03-02", ""), ("2024-03-03", "08:15:00")
+    ]
+
+
+def test_importing_the_same_file_twice_adds_nothing():
+    written, _ = run_import()
+    stored = normalize_health_records(pd.DataFrame(written, columns=HEALTH_SHEET_COLUMNS))
+
+    again, progress = run_import(existing_keys(stored))
+    assert again == []
+    assert sum(p["duplicates"] for p in progress) == 3
@@ -0,0 +1,59 @@
+import pandas as pd
+
+from rollups import overall_means, rollup_view, update_rollups
+
+
+def readings(systolic):
+    index = pd.date_range("2024-03-01 08:00", periods=len(systolic), freq="D")
+    return pd.DataFrame({
+        "Systolic": systolic,
+        "Diastolic": [80] * len(systolic),
+        "Pulse": [70] * len(systolic),
+        "Glucose(mmol/L)": [5.5] * len(systolic),
+    }, index=index)
+
+
+def test_edit_in_the_middle_rebuilds():
+    df = readings([120] * 5)
+    state = update_rollups(None, df)
+
+    edited = df.copy()
+    edited.iloc[2, edited.columns.get_loc("Systolic")] = 200
+    state = update_rollups(state, edited)
+
+    assert overall_means(state)["Systolic"] == 136.0
+    assert rollup_view(state, "daily")[("Systolic", "max")].max() == 200
+
+
+def test_append_after_edit_rebuilds():
+    df = readings([120] * 5)
+    state = update_rollups(None, df)
+
+    edited = readings([120, 120, 200, 120, 120, 130])
+    state = update_rollups(state, edited)
+
+    assert overall_means(state)["Systolic"] == edited["Systolic"].mean()
+
+
+def test_append_is_incremental():
+    df = readings([120] * 5)
+    state = update_rollups(None, df)
+
+    grown = readings([120] * 5 + [150])
+    state = update_rollups(state, grown)
+    rebuilt = update_rollups(None, grown)
+
+    assert state["rows"] == 6
+    assert state["fingerprint"] == rebuilt["fingerprint"]
+    assert overall_means(state)["Systolic"] == 125.0
+
+
+def test_unchanged_data_keeps_the_state():
+    df = readings([120] * 5)
+    df.attrs["data_version"] = ("health", 1, None)
+    state = update_rollups(None, df)
+
+    same = df.copy()
+    same.attrs["data_version"] = ("health", 2, None)
+    assert update_rollups(state, same) is state
+    assert state["version"] == ("health", 2, None)